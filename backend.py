@@ -8,12 +8,352 @@ create_transaction(conn, transaction),
 select_transactions(conn, date_from, date_to, *args),
 get_balance(conn, date_from, date_to, *args),
 get_expenses_by_category(conn, date_from, date_to, *args),
-delete_transactions(conn, ids)
+delete_transactions(conn, entries),
+transaction_fingerprint(date, value, currency, desc),
+create_transactions(conn, transactions, skip_duplicates),
+find_duplicate_transactions(conn),
+merge_duplicate_transactions(conn),
+archive_groups(conn, date_from, date_to),
+archive_transactions(conn, cutoff),
+undo_delete(conn, batch),
+purge_deleted_transactions(conn, days, batch_size, vacuum_pages),
+run_maintenance(conn),
+get_balance_by_account(conn, date_from, date_to, *args),
+create_account(conn, name),
+select_accounts(conn),
+sort_transactions(rows, order_by, descending),
+create_recurring_transaction(conn, transaction, period, every, start_date, end_date),
+materialize_recurring_transactions(conn, through),
+forecast_recurring_transactions(conn, date_from, date_to),
+set_budget(conn, categ, monthly_limit),
+get_budget_usage(conn, categ, month),
+get_category_spend(conn, month)
+and classes Transaction and TransactionResultSet holding selected entries.
 """
 
+import argparse
+from array import array
+import calendar
+import datetime
+import hashlib
+import math
+import os
 import sqlite3
 import sys
 
+# conversion rates to GBP(£)
+CURRENCY_RATES = {"£": 1, "€": 0.9, "$": 0.8}
+
+# account given to entries when none is chosen
+DEFAULT_ACCOUNT_ID = 1
+
+TRANSACTION_COLUMNS = "id, date, value, currency, desc, categ, account_id"
+
+# columns selected by select_transactions, the last one being name of the
+# database holding each entry, see transactions_query
+SELECTED_COLUMNS = TRANSACTION_COLUMNS + ", '{schema}'"
+
+# columns entries can be sorted by, each backed by a partial index
+SORT_COLUMNS = ("date", "value", "categ", "desc")
+
+# archive databases attached to a connection at once, SQLite allows 10
+# attached databases and one is left to the caller
+MAX_ATTACHED_ARCHIVES = 9
+
+# entries of the table pages run_maintenance checks the query plans of
+MAINTENANCE_PAGE_SIZE = 200
+
+# periods recurring transactions can repeat every
+RECURRING_PERIODS = ("daily", "weekly", "monthly", "yearly")
+
+# source of 'undo_journal' entries of deleted recurring transactions and of
+# occurrences not stored yet, see forecast_recurring_transactions
+RECURRING_SOURCE = "recurring"
+
+# occurrences of recurring transactions are forecast up to this many years ahead
+RECURRING_FORECAST_YEARS = 50
+
+SQL_CREATE_TRANSACTIONS_TABLE = """ CREATE TABLE IF NOT EXISTS {schema}.transactions (
+                                        id integer PRIMARY KEY AUTOINCREMENT,
+                                        date text,
+                                        value float,
+                                        currency text,
+                                        desc text,
+                                        categ text,
+                                        fingerprint text,
+                                        deleted_at text,
+                                        account_id integer,
+                                        recurring_id integer
+                                    ); """
+
+SQL_CREATE_ACCOUNTS_TABLE = """ CREATE TABLE IF NOT EXISTS accounts (
+                                    id integer PRIMARY KEY,
+                                    name text UNIQUE
+                                ); """
+
+SQL_CREATE_RECURRING_TABLE = """ CREATE TABLE IF NOT EXISTS recurring_transactions (
+                                     id integer PRIMARY KEY,
+                                     value float,
+                                     currency text,
+                                     desc text,
+                                     categ text,
+                                     account_id integer,
+                                     period text,
+                                     every integer,
+                                     start_date text,
+                                     end_date text,
+                                     materialized_through text,
+                                     deleted_at text
+                                 ); """
+
+# occurrences of recurring transactions after the ones stored, filled for
+# each query by forecast_recurring_transactions. The table is temporary, so
+# filling it does not write to the database file
+SQL_CREATE_FORECAST_TABLE = """ CREATE TEMP TABLE IF NOT EXISTS recurring_forecast (
+                                    id integer,
+                                    date text,
+                                    value float,
+                                    currency text,
+                                    desc text,
+                                    categ text,
+                                    account_id integer,
+                                    deleted_at text
+                                ); """
+
+# spend_counters holds total value of live entries of the main database for
+# each month, category and currency, kept up to date by the triggers. Entries
+# moved to archive databases are counted in monthly_rollups instead, see
+# archive_transactions
+SQL_CREATE_BUDGET_TABLES = """ CREATE TABLE IF NOT EXISTS budgets (
+                                   categ text PRIMARY KEY,
+                                   monthly_limit float
+                               );
+                               CREATE TABLE IF NOT EXISTS spend_counters (
+                                   month text,
+                                   categ text,
+                                   currency text,
+                                   total float,
+                                   entries integer,
+                                   PRIMARY KEY (month, categ, currency)
+                               );
+                               CREATE TRIGGER IF NOT EXISTS spend_counters_insert
+                               AFTER INSERT ON transactions
+                               WHEN NEW.deleted_at IS NULL
+                               BEGIN
+                                   INSERT OR IGNORE INTO spend_counters
+                                   VALUES (substr(NEW.date, 1, 7), IFNULL(NEW.categ, ''),
+                                           IFNULL(NEW.currency, ''), 0, 0);
+                                   UPDATE spend_counters
+                                   SET total = total + NEW.value, entries = entries + 1
+                                   WHERE month = substr(NEW.date, 1, 7)
+                                   AND categ = IFNULL(NEW.categ, '')
+                                   AND currency = IFNULL(NEW.currency, '');
+                               END;
+                               CREATE TRIGGER IF NOT EXISTS spend_counters_delete
+                               AFTER DELETE ON transactions
+                               WHEN OLD.deleted_at IS NULL
+                               BEGIN
+                                   UPDATE spend_counters
+                                   SET total = total - OLD.value, entries = entries - 1
+                                   WHERE month = substr(OLD.date, 1, 7)
+                                   AND categ = IFNULL(OLD.categ, '')
+                                   AND currency = IFNULL(OLD.currency, '');
+                               END;
+                               CREATE TRIGGER IF NOT EXISTS spend_counters_update
+                               AFTER UPDATE OF date, value, currency, categ, deleted_at
+                               ON transactions
+                               BEGIN
+                                   UPDATE spend_counters
+                                   SET total = total - OLD.value, entries = entries - 1
+                                   WHERE OLD.deleted_at IS NULL
+                                   AND month = substr(OLD.date, 1, 7)
+                                   AND categ = IFNULL(OLD.categ, '')
+                                   AND currency = IFNULL(OLD.currency, '');
+                                   INSERT OR IGNORE INTO spend_counters
+                                   SELECT substr(NEW.date, 1, 7), IFNULL(NEW.categ, ''),
+                                          IFNULL(NEW.currency, ''), 0, 0
+                                   WHERE NEW.deleted_at IS NULL;
+                                   UPDATE spend_counters
+                                   SET total = total + NEW.value, entries = entries + 1
+                                   WHERE NEW.deleted_at IS NULL
+                                   AND month = substr(NEW.date, 1, 7)
+                                   AND categ = IFNULL(NEW.categ, '')
+                                   AND currency = IFNULL(NEW.currency, '');
+                               END; """
+
+SQL_CREATE_ARCHIVE_TABLES = """ CREATE TABLE IF NOT EXISTS archive_partitions (
+                                    year integer PRIMARY KEY,
+                                    path text,
+                                    entries integer
+                                );
+                                CREATE TABLE IF NOT EXISTS monthly_rollups (
+                                    month text,
+                                    currency text,
+                                    categ text,
+                                    total float,
+                                    entries integer,
+                                    PRIMARY KEY (month, currency, categ)
+                                );
+                                CREATE TABLE IF NOT EXISTS undo_journal (
+                                    id integer PRIMARY KEY,
+                                    batch integer,
+                                    source text,
+                                    transaction_id integer,
+                                    deleted_at text
+                                ); """
+
+class Transaction:
+    """Class that holds one entry of 'transactions' table. Fields can be
+    accessed by name or by position in TRANSACTION_COLUMNS, so an entry can
+    be used in place of the tuple returned by sqlite3.
+
+    Attributes:
+        id (int): id of the entry
+        date (string): date of the entry
+        value (float): value of the entry in its currency
+        currency (string): currency of the entry
+        desc (string): description of the entry
+        categ (string): category of the entry
+        account_id (int): id of account of the entry
+        source (string): database holding the entry, "main" or name of an
+            archive database, RECURRING_SOURCE for occurrences of recurring
+            transactions not stored yet, with id of the recurring transaction,
+            not one of the positional fields
+    """
+
+    FIELDS = ("id", "date", "value", "currency", "desc", "categ", "account_id")
+
+    __slots__ = FIELDS + ("source",)
+
+    def __init__(self, id, date, value, currency, desc, categ, account_id,
+                 source="main"):
+        self.id = id
+        self.date = date
+        self.value = value
+        self.currency = currency
+        self.desc = desc
+        self.categ = categ
+        self.account_id = account_id
+        self.source = source
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __eq__(self, other):
+        try:
+            return tuple(self) == tuple(other)
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Transaction{tuple(self)!r}"
+
+
+class TransactionResultSet:
+    """Class that holds entries returned by select_transactions column by
+    column. Numbers are stored in typed arrays and strings are shared
+    between entries, categories and currencies being interned, so large
+    results take a fraction of the memory of a list of tuples. Indexing and
+    iterating yield Transaction objects created on access.
+
+    Attributes:
+        ids (array): id's of the entries
+        dates (list): dates of the entries
+        values (array): values of the entries
+        currencies (list): currencies of the entries
+        descs (list): descriptions of the entries
+        categs (list): categories of the entries
+        account_ids (array): id's of accounts of the entries, 0 if unknown
+        sources (list): databases holding the entries, see Transaction
+    """
+
+    def __init__(self, rows=()):
+        """
+        Parameters:
+            rows (iterable): entries as tuples ordered as TRANSACTION_COLUMNS,
+                optionally followed by the database holding the entry
+        """
+        self.ids = array("q")
+        self.dates = []
+        self.values = array("d")
+        self.currencies = []
+        self.descs = []
+        self.categs = []
+        self.account_ids = array("q")
+        self.sources = []
+        self._strings = {}
+        for row in rows:
+            self.append(row)
+
+    def _share(self, text):
+        """Returns stored string equal to text, storing text if there is none"""
+        if text is None:
+            return None
+        return self._strings.setdefault(text, text)
+
+    def append(self, row):
+        """Adds an entry ordered as SELECTED_COLUMNS or TRANSACTION_COLUMNS
+        to the result set"""
+        id, date, value, currency, desc, categ, account_id = row[:7]
+        self.ids.append(id)
+        self.dates.append(self._share(date))
+        self.values.append(value)
+        self.currencies.append(currency if currency is None else sys.intern(currency))
+        self.descs.append(self._share(desc))
+        self.categs.append(categ if categ is None else sys.intern(categ))
+        self.account_ids.append(account_id or 0)
+        self.sources.append(sys.intern(row[7]) if len(row) > 7 else "main")
+
+    def subset(self, indices):
+        """Returns new result set with entries at given positions
+
+        Parameters:
+            indices (iterable): positions of the entries, in order
+        Returns:
+            TransactionResultSet: selected entries
+        """
+        result = TransactionResultSet()
+        for index in indices:
+            result.ids.append(self.ids[index])
+            result.dates.append(self.dates[index])
+            result.values.append(self.values[index])
+            result.currencies.append(self.currencies[index])
+            result.descs.append(self.descs[index])
+            result.categs.append(self.categs[index])
+            result.account_ids.append(self.account_ids[index])
+            result.sources.append(self.sources[index])
+        result._strings = self._strings
+        return result
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.subset(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TransactionResultSet index out of range")
+        return Transaction(self.ids[index], self.dates[index], self.values[index],
+                           self.currencies[index], self.descs[index],
+                           self.categs[index], self.account_ids[index],
+                           self.sources[index])
+
+    def __iter__(self):
+        for row in zip(self.ids, self.dates, self.values, self.currencies,
+                       self.descs, self.categs, self.account_ids, self.sources):
+            yield Transaction(*row)
+
+
 def create_connection(db_file):
     """Creates a connection to the SQLite database specified by db_file.
 
@@ -24,13 +364,117 @@ def create_connection(db_file):
     """
     try:
         conn = sqlite3.connect(db_file)
+        conn.create_function("fingerprint", 4, transaction_fingerprint)
         return conn
     except sqlite3.Error as e:
         print(e, file=sys.stderr)
     return None
 
-def select_transactions(conn, date_from, date_to, *args):
+def filter_conditions(date_from, date_to, *args, accounts=None):
+    """Returns WHERE clause and its parameters for conditions given.
+
+    Parameters:
+        date_from (string): Earliest date to select entries from
+        data_to (string): Latest date to select entries from
+        *args: Variable length argument list, same as in select_transactions
+        accounts (list): Id's of accounts to select entries from, all if None
+    Returns:
+        tuple: (string): WHERE clause, (list): parameters of the clause
+    """
+    conditions = ["deleted_at IS NULL", "date BETWEEN ? AND ?"]
+    params = [date_from, date_to]
+    if len(args) in (3, 4):
+        conditions.append("value BETWEEN ? AND ?")
+        params += [args[0], args[1]]
+        args = args[2:]
+    if len(args) in (1, 2):
+        conditions.append("(categ = ? OR ? = 'All')")
+        params += [args[0], args[0]]
+    if len(args) == 2:
+        conditions.append("desc LIKE ?")
+        params.append('%'+args[1]+'%')
+    if accounts is not None:
+        conditions.append(f"account_id IN ({', '.join('?'*len(accounts))})")
+        params += list(accounts)
+    return " AND ".join(conditions), params
+
+def transactions_query(conn, columns, date_from, date_to, *args, accounts=None,
+                       index=None, schemas=(), forecast=False):
+    """Returns query selecting columns from 'transactions' tables of the main
+    and archive databases with conditions given.
+
+    Parameters:
+        conn (Connection): Connection object
+        columns (string): Comma separated columns to select, {schema} is
+            replaced by name of the database each table belongs to
+        date_from (string): Earliest date to select entries from
+        data_to (string): Latest date to select entries from
+        *args: Variable length argument list, same as in select_transactions
+        accounts (list): Id's of accounts to select entries from, all if None
+        index (string): Name of index the tables are read through, chosen
+            by SQLite if None
+        schemas (list): Names of attached archive databases read besides the
+            main database, see archive_groups
+        forecast (bool): If True, occurrences of recurring transactions
+            filled in by forecast_recurring_transactions are selected too
+    Returns:
+        tuple: (string): SQL query, (list): parameters of the query
+    """
+    where, params = filter_conditions(date_from, date_to, *args, accounts=accounts)
+    indexed_by = f" INDEXED BY {index}" if index else ""
+    queries = []
+    for schema in ["main", *schemas]:
+        queries.append(f"SELECT {columns.format(schema=schema)} "
+                       f"FROM {schema}.transactions{indexed_by} "
+                       f"WHERE {where}")
+    if forecast:
+        queries.append(f"SELECT {columns.format(schema=RECURRING_SOURCE)} "
+                       f"FROM temp.recurring_forecast "
+                       f"WHERE {where}")
+    return " UNION ALL ".join(queries), params*len(queries)
+
+def iterate_transactions(conn, columns, date_from, date_to, *args, accounts=None,
+                         forecast=False):
+    """Yields columns of entries of the main and archive databases matching
+    conditions given in order of date and id, reading archives a few years
+    at a time, see archive_groups.
+
+    Parameters:
+        conn (Connection): Connection object
+        columns (string): Comma separated columns to select including date
+            and id, see transactions_query
+        date_from (string): Earliest date to select entries from
+        data_to (string): Latest date to select entries from
+        *args: Variable length argument list, same as in select_transactions
+        accounts (list): Id's of accounts to select entries from, all if None
+        forecast (bool): If True, occurrences of recurring transactions not
+            stored yet are included, see forecast_recurring_transactions
+    Yields:
+        tuple: selected columns of an entry
+    """
+    if forecast:
+        forecast_recurring_transactions(conn, date_from, date_to)
+    for part_from, part_to, schemas in archive_groups(conn, date_from, date_to):
+        sql, params = transactions_query(conn, columns, part_from, part_to, *args,
+                                         accounts=accounts, schemas=schemas,
+                                         forecast=forecast)
+        cur = conn.execute(sql + " ORDER BY date, id", params)
+        try:
+            yield from cur
+        finally:
+            # lets archive_groups detach archives of loops left early
+            cur.close()
+
+def select_transactions(conn, date_from, date_to, *args, accounts=None,
+                        order_by="date", descending=False, limit=None, offset=0):
     """Selects all columns from 'transaction' with conditions given.
+    Entries moved to archive databases are included when the date interval
+    overlaps archived years. Entries are sorted by a column of SORT_COLUMNS
+    and then by id, so that pages selected with limit and offset do not
+    overlap. Intervals overlapping more archived years than a connection can
+    attach at once are read in parts, whose sorted entries are merged.
+    Occurrences of recurring transactions not stored yet are included, see
+    forecast_recurring_transactions.
 
     Parameters:
         conn (Connection): Connection object
@@ -42,50 +486,114 @@ def select_transactions(conn, date_from, date_to, *args):
             (string): Category, (string): Search
             (float): Min_value, (float): Max_value, (string): Category
             (float): Min_value, (float): Max_value, (string): Category, (string): Search
+        accounts (list): Id's of accounts to select entries from, all if None
+        order_by (string): Column of SORT_COLUMNS to sort entries by
+        descending (bool): If True, entries are sorted in descending order
+        limit (int): Maximum number of entries to select, all if None
+        offset (int): Number of entries to skip before selecting
 
     Returns:
-        list of tuples: Entries from 'transaction' table
+        TransactionResultSet: Entries from 'transaction' table
     """
+    if order_by not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort entries by '{order_by}'")
+    forecast_recurring_transactions(conn, date_from, date_to)
+    # each part holds the first offset + limit entries of its interval, as
+    # any of them can be on the page once the parts are merged
+    merged = len(archived_years(conn, date_from, date_to)) > MAX_ATTACHED_ARCHIVES
+    part_limit = offset + limit if merged and limit is not None else limit
+    part_offset = 0 if merged else offset
+    parts = []
     cur = conn.cursor()
-    if len(args) == 0:
-        cur.execute('''SELECT * FROM transactions
-                        WHERE date BETWEEN ? AND ?
-                        ORDER BY date  ''', (date_from, date_to))
-    if len(args) == 1:
-        cur.execute('''SELECT * FROM transactions
-                        WHERE date BETWEEN ? AND ?
-                        AND (categ = ? OR ? = 'All')
-                        ORDER BY date  ''',
-                    (date_from, date_to, args[0], args[0]))
-    if len(args) == 2:
-        cur.execute('''SELECT * FROM transactions
-                        WHERE date BETWEEN ? AND ?
-                        AND (categ = ? OR ? = 'All')
-                        AND desc LIKE ?
-                        ORDER BY date  ''',
-                    (date_from, date_to, args[0], args[0], '%'+args[1]+'%'))
-
-    if len(args) == 3:
-        cur.execute('''SELECT * FROM transactions
-                        WHERE date BETWEEN ? AND ?
-                        AND value BETWEEN ? AND ?
-                        AND (categ = ? OR ? = 'All')
-                        ORDER BY date  ''',
-                    (date_from, date_to, args[0], args[1], args[2], args[2]))
-    if len(args) == 4:
-        cur.execute('''SELECT * FROM transactions
-                        WHERE date BETWEEN ? AND ?
-                        AND value BETWEEN ? AND ?
-                        AND (categ = ? OR ? = 'All')
-                        AND desc LIKE ?
-                        ORDER BY date  ''',
-                    (date_from, date_to, args[0], args[1], args[2], args[2],
-                     '%'+args[3]+'%'))
+    for part_from, part_to, schemas in archive_groups(conn, date_from, date_to):
+        index = None
+        if (order_by != "date" and limit is not None
+                and is_sort_index_faster(conn, part_from, part_to, offset + limit,
+                                         schemas)):
+            index = f"idx_transactions_live_{order_by}"
+        sql, params = sorted_transactions_query(conn, part_from, part_to, *args,
+                                                accounts=accounts, order_by=order_by,
+                                                descending=descending, limit=part_limit,
+                                                offset=part_offset, index=index,
+                                                schemas=schemas, forecast=True)
+        cur.execute(sql, params)
+        parts.append(TransactionResultSet(cur))
+    if not merged:
+        return parts[0]
+    rows = sort_transactions(TransactionResultSet((*row, row.source)
+                                                  for part in parts for row in part),
+                             order_by, descending)
+    return rows[offset:] if limit is None else rows[offset:offset + limit]
 
-    return cur.fetchall()
+def sorted_transactions_query(conn, date_from, date_to, *args, accounts=None,
+                              order_by="date", descending=False, limit=None, offset=0,
+                              index=None, schemas=(), forecast=False):
+    """Returns query run by select_transactions with arguments given.
+
+    Parameters:
+        conn (Connection): Connection object
+        date_from (string): Earliest date to select entries from
+        data_to (string): Latest date to select entries from
+        *args: Variable length argument list, same as in select_transactions
+        accounts (list): Id's of accounts to select entries from, all if None
+        order_by (string): Column of SORT_COLUMNS to sort entries by
+        descending (bool): If True, entries are sorted in descending order
+        limit (int): Maximum number of entries to select, all if None
+        offset (int): Number of entries to skip before selecting
+        index (string): Name of index the tables are read through, chosen
+            by SQLite if None
+        schemas (list): Names of attached archive databases read besides the
+            main database, see archive_groups
+        forecast (bool): If True, occurrences of recurring transactions not
+            stored yet are selected too, see forecast_recurring_transactions
+    Returns:
+        tuple: (string): SQL query, (list): parameters of the query
+    """
+    sql, params = transactions_query(conn, SELECTED_COLUMNS, date_from, date_to,
+                                     *args, accounts=accounts, index=index,
+                                     schemas=schemas, forecast=forecast)
+    direction = "DESC" if descending else "ASC"
+    sql += f' ORDER BY "{order_by}" {direction}, id {direction}'
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+    return sql, params
 
-def get_balance(conn, date_from, date_to, *args):
-    """Returns dictionary containing amount spent, received and total balance.
+def is_sort_index_faster(conn, date_from, date_to, entries_needed, schemas=()):
+    """Checks if the first entries of date interval sorted by a column other
+    than date are found faster by reading the index of that column in order
+    than by sorting every entry of the interval. SQLite always chooses the
+    latter, as it cannot tell how many entries the interval holds.
+
+    Parameters:
+        conn (Connection): Connection object
+        date_from (string): Earliest date to select entries from
+        data_to (string): Latest date to select entries from
+        entries_needed (int): Number of sorted entries to be selected
+        schemas (list): Names of attached archive databases read besides the
+            main database, see archive_groups
+    Returns:
+        bool: True if index of the sort column should be used
+    """
+    cur = conn.cursor()
+    entries = 0
+    for schema in ["main", *schemas]:
+        # separate subqueries let SQLite read both ends of the table only
+        low, high = cur.execute(f'''SELECT (SELECT min(id) FROM {schema}.transactions),
+                                          (SELECT max(id) FROM {schema}.transactions) '''
+                                ).fetchone()
+        if low is not None:
+            entries += high - low + 1
+    # the index is read until about entries_needed*entries/in_interval entries
+    # are passed, so it is faster once in_interval exceeds the threshold
+    threshold = int(math.sqrt(entries_needed*entries)) + 1
+    sql, params = transactions_query(conn, "1", date_from, date_to, schemas=schemas)
+    cur.execute(f"SELECT count(*) FROM ({sql} LIMIT ?)", params + [threshold])
+    return cur.fetchone()[0] >= threshold
+
+def get_balance(conn, date_from, date_to, *args, accounts=None):
+    """Returns dictionary containing amount spent, received and total balance
+    of all accounts given together.
 
     Parameters:
         conn (Connection): Connection object
@@ -97,29 +605,54 @@ def get_balance(conn, date_from, date_to, *args):
             (string): Category, (string): Search
             (float): Min_value, (float): Max_value, (string): Category
             (float): Min_value, (float): Max_value, (string): Category, (string): Search
+        accounts (list): Id's of accounts to select entries from, all if None
     Returns:
         dict: 'Expenses', 'Received' and 'Total' amounts in GBP(£)
     """
-    rows = select_transactions(conn, date_from, date_to, *args)
-    total = 0
-    expenses = 0
-    income = 0
-    multiplier = 1
-    for row in rows:
-        if row[3] == "£":
-            multiplier = 1
-        elif row[3] == "€":
-            multiplier = 0.9
-        elif row[3] == "$":
-            multiplier = 0.8
-        total += float(row[2])*multiplier
-        if float(row[2]) > 0:
-            income += row[2]*multiplier
-        else:
-            expenses += row[2]*multiplier
-    return {"Expenses":expenses, "Received":income, "Total":total}
+    balance = {"Expenses":0, "Received":0, "Total":0}
+    for account_balance in get_balance_by_account(conn, date_from, date_to, *args,
+                                                  accounts=accounts).values():
+        for key in balance:
+            balance[key] += account_balance[key]
+    return balance
+
+def get_balance_by_account(conn, date_from, date_to, *args, accounts=None):
+    """Returns amount spent, received and total balance of each account.
+
+    Parameters:
+        conn (Connection): Connection object
+        date_from (string): Earliest date to select entries from
+        data_to (string): Latest date to select entries from
+        *args: Variable length argument list, same as in get_balance
+        accounts (list): Id's of accounts to select entries from, all if None
+    Returns:
+        dict: 'Expenses', 'Received' and 'Total' amounts in GBP(£) by account
+            name, for accounts having entries
+    """
+    forecast_recurring_transactions(conn, date_from, date_to)
+    cur = conn.cursor()
+    totals = []
+    for part_from, part_to, schemas in archive_groups(conn, date_from, date_to):
+        sql, params = transactions_query(conn, "value, currency, account_id",
+                                         part_from, part_to, *args, accounts=accounts,
+                                         schemas=schemas, forecast=True)
+        cur.execute(f'''SELECT accounts.name, currency,
+                               SUM(CASE WHEN value > 0 THEN value ELSE 0 END),
+                               SUM(CASE WHEN value > 0 THEN 0 ELSE value END)
+                        FROM ({sql}) AS entries
+                        LEFT JOIN main.accounts ON accounts.id = entries.account_id
+                        GROUP BY entries.account_id, currency ''', params)
+        totals += cur.fetchall()
+    balances = {}
+    for name, currency, received, spent in totals:
+        multiplier = CURRENCY_RATES.get(currency, 1)
+        balance = balances.setdefault(f"{name}", {"Expenses":0, "Received":0, "Total":0})
+        balance["Received"] += received*multiplier
+        balance["Expenses"] += spent*multiplier
+        balance["Total"] = balance["Received"] + balance["Expenses"]
+    return balances
 
-def get_expenses_by_category(conn, date_from, date_to, *args):
+def get_expenses_by_category(conn, date_from, date_to, *args, accounts=None):
     """Returns total expenses for each category found
 
     Parameters:
@@ -132,87 +665,1269 @@ def get_expenses_by_category(conn, date_from, date_to, *args):
         (string): Category, (string): Search
         (float): Min_value, (float): Max_value, (string): Category
         (float): Min_value, (float): Max_value, (string): Category, (string): Search
+    accounts (list): Id's of accounts to select entries from, all if None
     Returns:
         dict: Balance for each category found
     """
-    rows = select_transactions(conn, date_from, date_to, *args)
+    forecast_recurring_transactions(conn, date_from, date_to)
+    cur = conn.cursor()
+    totals = []
+    for part_from, part_to, schemas in archive_groups(conn, date_from, date_to):
+        sql, params = transactions_query(conn, "value, currency, categ",
+                                         part_from, part_to, *args, accounts=accounts,
+                                         schemas=schemas, forecast=True)
+        cur.execute(f'''SELECT categ, currency, SUM(value)
+                        FROM ({sql})
+                        GROUP BY categ, currency ''', params)
+        totals += cur.fetchall()
     expenses_by_category = {}
+    for categ, currency, value in totals:
+        multiplier = CURRENCY_RATES.get(currency, 1)
+        expenses_by_category[f"{categ}"] = (expenses_by_category.get(f"{categ}", 0)
+                                            + value*multiplier)
+    return expenses_by_category
+
+
+def parse_filters(*args):
+    """Returns filter arguments of select_transactions by name.
+
+    Parameters:
+        *args: Variable length argument list, same as in select_transactions
+    Returns:
+        dict: 'Value range' (tuple), 'Category' and 'Search' (string),
+            None for conditions not given
+    """
+    filters = {"Value range": None, "Category": None, "Search": None}
+    if len(args) in (3, 4):
+        filters["Value range"] = (args[0], args[1])
+        args = args[2:]
+    if args and args[0] != "All":
+        filters["Category"] = args[0]
+    if len(args) == 2 and args[1]:
+        filters["Search"] = args[1]
+    return filters
+
+def is_narrower_query(previous, query):
+    """Checks if every entry matching query also matches previous query,
+    so that entries of query can be found among entries of previous one
+    with refine_transactions.
+
+    Parameters:
+        previous (tuple): date_from, date_to, filter arguments tuple and
+            accounts of select_transactions used before
+        query (tuple): date_from, date_to, filter arguments tuple and accounts
+    Returns:
+        bool: True if query is the same as or narrower than previous
+    """
+    old = parse_filters(*previous[2])
+    new = parse_filters(*query[2])
+    if query[0] < previous[0] or query[1] > previous[1]:
+        return False
+    if previous[3] is not None:
+        if query[3] is None or not set(query[3]) <= set(previous[3]):
+            return False
+    if old["Value range"] is not None:
+        if (new["Value range"] is None
+                or new["Value range"][0] < old["Value range"][0]
+                or new["Value range"][1] > old["Value range"][1]):
+            return False
+    if old["Category"] is not None and new["Category"] != old["Category"]:
+        return False
+    if new["Search"] is not None:
+        # LIKE wildcards and case folding of non-ASCII text are left to SQLite
+        if (not new["Search"].isascii() or "%" in new["Search"]
+                or "_" in new["Search"]):
+            return False
+    if old["Search"] is not None:
+        if new["Search"] is None or old["Search"].lower() not in new["Search"].lower():
+            return False
+    return True
+
+def refine_transactions(rows, date_from, date_to, *args, accounts=None):
+    """Selects entries matching conditions given from entries already
+    returned by select_transactions, see is_narrower_query.
+
+    Parameters:
+        rows (TransactionResultSet): Entries returned by select_transactions
+        date_from (string): Earliest date to select entries from
+        data_to (string): Latest date to select entries from
+        *args: Variable length argument list, same as in select_transactions
+        accounts (list): Id's of accounts to select entries from, all if None
+    Returns:
+        TransactionResultSet: Entries matching the conditions
+    """
+    filters = parse_filters(*args)
+    value_range = filters["Value range"]
+    search = filters["Search"].lower() if filters["Search"] else None
+    if not isinstance(rows, TransactionResultSet):
+        rows = TransactionResultSet(rows)
+    return rows.subset(index for index, row in enumerate(rows)
+                       if date_from <= row.date <= date_to
+                       and (value_range is None
+                            or value_range[0] <= row.value <= value_range[1])
+                       and (filters["Category"] is None or row.categ == filters["Category"])
+                       and (search is None or search in (row.desc or "").lower())
+                       and (accounts is None or row.account_id in accounts))
+
+def sort_transactions(rows, order_by="date", descending=False):
+    """Sorts entries returned by select_transactions in the same order as
+    select_transactions with the same arguments would.
+
+    Parameters:
+        rows (TransactionResultSet): Entries returned by select_transactions
+        order_by (string): Column of SORT_COLUMNS to sort entries by
+        descending (bool): If True, entries are sorted in descending order
+    Returns:
+        TransactionResultSet: Sorted entries
+    """
+    if order_by not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort entries by '{order_by}'")
+    if not isinstance(rows, TransactionResultSet):
+        rows = TransactionResultSet(rows)
+    column = getattr(rows, order_by + "s")
+
+    def sort_key(index):
+        value = column[index]
+        # NULL sorts before any other value in SQLite
+        return (value is not None, "" if value is None else value, rows.ids[index])
+
+    return rows.subset(sorted(range(len(rows)), key=sort_key, reverse=descending))
+
+def get_balance_of_rows(rows):
+    """Returns dictionary containing amount spent, received and total balance
+    of entries returned by select_transactions.
+
+    Parameters:
+        rows (TransactionResultSet): Entries returned by select_transactions
+    Returns:
+        dict: 'Expenses', 'Received' and 'Total' amounts in GBP(£)
+    """
+    expenses = 0
+    income = 0
     for row in rows:
-        if row[3] == "£":
-            multiplier = 1
-        elif row[3] == "€":
-            multiplier = 0.9
-        elif row[3] == "$":
-            multiplier = 0.8
-        try:
-            expenses_by_category[f"{row[5]}"] += float(row[2])*multiplier
-        except KeyError:
-            expenses_by_category[f"{row[5]}"] = float(row[2])*multiplier
+        if row.value > 0:
+            income += row.value*CURRENCY_RATES.get(row.currency, 1)
+        else:
+            expenses += row.value*CURRENCY_RATES.get(row.currency, 1)
+    return {"Expenses":expenses, "Received":income, "Total":income + expenses}
+
+def get_expenses_by_category_of_rows(rows):
+    """Returns total expenses for each category found in entries returned by
+    select_transactions.
+
+    Parameters:
+        rows (TransactionResultSet): Entries returned by select_transactions
+    Returns:
+        dict: Balance for each category found
+    """
+    expenses_by_category = {}
+    for row in rows:
+        expenses_by_category[f"{row.categ}"] = (expenses_by_category.get(f"{row.categ}", 0)
+                                                + row.value*CURRENCY_RATES.get(row.currency, 1))
     return expenses_by_category
 
+def delete_transactions(conn, entries):
+    """Mark entries of 'transactions' tables as deleted and record them in
+    'undo_journal' table. Entries are identified by the database holding
+    them as well as their id, as entries archived by older versions of the
+    program can share id's with entries of the main database.
+
+    Parameters:
+        conn (Connection): Connection object
+        entries (list): (source, id) of entries to be deleted, source being
+            "main" or name of archive database, see Transaction
+    Returns:
+        int: Number of the batch in 'undo_journal' to pass to undo_delete
+    """
+    items = {}
+    for source, item in entries:
+        items.setdefault(source, []).append(item)
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(batch), 0) + 1 FROM undo_journal")
+    batch = cur.fetchone()[0]
+    # archives are attached one at a time and detached once their entries
+    # are deleted, as a connection can only attach a few databases
+    for source, ids in items.items():
+        if source != "main" and not attach_archive(conn, source):
+            raise ValueError(f"Unknown database '{source}'")
+        changed = False
+        for item in ids:
+            cur.execute(f'''UPDATE {source}.transactions SET deleted_at = datetime('now')
+                            WHERE id=? AND deleted_at IS NULL ''', (item,))
+            if cur.rowcount:
+                cur.execute('''INSERT INTO undo_journal(batch, source, transaction_id,
+                                                         deleted_at)
+                                VALUES(?, ?, ?, datetime('now')) ''', (batch, source, item))
+                changed = True
+        if source != "main":
+            if changed:
+                rollup_archive(conn, source)
+            conn.commit()
+            detach_archives(conn, [source])
+    conn.commit()
+    return batch
+
+def undo_delete(conn, batch=None):
+    """Restores entries deleted by delete_transactions.
 
-def delete_transactions(conn, ids):
-    """Delete entries from 'transactions' table given their id's.
+    Parameters:
+        conn (Connection): Connection object
+        batch (int): Batch returned by delete_transactions, latest if None
+    Returns:
+        list: (source, id) of restored entries, source being RECURRING_SOURCE
+            for recurring transactions deleted by delete_recurring_transaction
+    """
+    cur = conn.cursor()
+    if batch is None:
+        cur.execute("SELECT MAX(batch) FROM undo_journal")
+        batch = cur.fetchone()[0]
+    cur.execute("SELECT source, transaction_id FROM undo_journal WHERE batch = ?", (batch,))
+    entries = cur.fetchall()
+    items = {}
+    for source, item in entries:
+        items.setdefault(source, []).append(item)
+    # archives are attached one at a time, see delete_transactions
+    for source, ids in items.items():
+        if source == RECURRING_SOURCE:
+            cur.executemany("UPDATE recurring_transactions SET deleted_at = NULL WHERE id=? ",
+                            [(item,) for item in ids])
+        elif source == "main":
+            cur.executemany("UPDATE main.transactions SET deleted_at = NULL WHERE id=? ",
+                            [(item,) for item in ids])
+        elif attach_archive(conn, source):
+            cur.executemany(f"UPDATE {source}.transactions SET deleted_at = NULL WHERE id=? ",
+                            [(item,) for item in ids])
+            rollup_archive(conn, source)
+            conn.commit()
+            detach_archives(conn, [source])
+    cur.execute("DELETE FROM undo_journal WHERE batch = ?", (batch,))
+    conn.commit()
+    return entries
+
+def purge_deleted_transactions(conn, days=30, batch_size=500, vacuum_pages=100):
+    """Permanently removes one batch of entries deleted more than given
+    number of days ago from the main and archive databases, then frees
+    unused pages of the main database file.
 
     Parameters:
-        ids (list): List of id's of entries to be deleted
+        conn (Connection): Connection object
+        days (int): Entries deleted within this many days can still be restored
+        batch_size (int): Maximum number of entries removed
+        vacuum_pages (int): Maximum number of free pages returned to the system
+    Returns:
+        int: Number of entries removed
     """
+    cutoff = f"-{days} days"
     cur = conn.cursor()
-    for item in ids:
-        cur.execute("DELETE from transactions WHERE id=? ", (item,))
+    cur.execute('''DELETE FROM main.transactions
+                    WHERE id IN (SELECT id FROM main.transactions
+                                 WHERE deleted_at < datetime('now', ?)
+                                 LIMIT ?) ''', (cutoff, batch_size))
+    purged = cur.rowcount
+    # entries deleted from archives are found through 'undo_journal', so that
+    # only archives holding some are attached, one at a time
+    cur.execute('''SELECT id, source, transaction_id FROM undo_journal
+                    WHERE deleted_at < datetime('now', ?)
+                    AND source NOT IN ('main', ?)
+                    ORDER BY source
+                    LIMIT ? ''', (cutoff, RECURRING_SOURCE, batch_size - purged))
+    items = {}
+    for journal_id, source, item in cur.fetchall():
+        items.setdefault(source, []).append((journal_id, item))
+    for source, journal in items.items():
+        if attach_archive(conn, source):
+            cur.executemany(f'''DELETE FROM {source}.transactions
+                                WHERE id = ? AND deleted_at IS NOT NULL ''',
+                            [(item,) for _, item in journal])
+            purged += cur.rowcount
+            conn.commit()
+            detach_archives(conn, [source])
+        cur.executemany("DELETE FROM undo_journal WHERE id = ?",
+                        [(journal_id,) for journal_id, _ in journal])
+    cur.execute('''DELETE FROM recurring_transactions
+                    WHERE deleted_at < datetime('now', ?) ''', (cutoff,))
+    cur.execute('''DELETE FROM undo_journal
+                    WHERE deleted_at < datetime('now', ?)
+                    AND source IN ('main', ?) ''', (cutoff, RECURRING_SOURCE))
     conn.commit()
+    # executescript runs the pragma to the end, execute frees one page
+    conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
+    return purged
 
 def create_transactions_table(conn):
-    """Create a table from the create_table_sql statement.
+    """Create 'transactions' table if it does not exist and bring older
+    tables up to date.
+
     Parameters:
         conn (Connection): Connection object
-        create_table_sql (String): a CREATE TABLE statement
-
     """
-    sql_create_transactions_table = """ CREATE TABLE IF NOT EXISTS transactions (
-                                        id integer PRIMARY KEY,
-                                        date text,
-                                        value float,
-                                        currency text,
-                                        desc text,
-                                        categ text
-                                    ); """
     try:
         c = conn.cursor()
-        c.execute(sql_create_transactions_table)
+        c.execute(SQL_CREATE_TRANSACTIONS_TABLE.format(schema="main"))
+        c.execute(SQL_CREATE_ACCOUNTS_TABLE)
+        c.execute(SQL_CREATE_RECURRING_TABLE)
+        if "deleted_at" not in [row[1] for row in
+                                c.execute("PRAGMA table_info(recurring_transactions)")]:
+            c.execute("ALTER TABLE recurring_transactions ADD COLUMN deleted_at text")
+        c.execute("INSERT OR IGNORE INTO accounts(id, name) VALUES(?, 'Main')",
+                  (DEFAULT_ACCOUNT_ID,))
+        c.executescript(SQL_CREATE_ARCHIVE_TABLES)
+        upgrade_transactions_table(conn)
+        conn.commit()
+        c.execute("SELECT 1 FROM sqlite_master WHERE name = 'spend_counters'")
+        new_counters = c.fetchone() is None
+        c.executescript(SQL_CREATE_BUDGET_TABLES)
+        if new_counters:
+            rebuild_spend_counters(conn)
+            conn.commit()
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] == 0:
+            # lets purge_deleted_transactions free pages a few at a time
+            c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            c.execute("VACUUM")
+        # readers, such as exports streaming many entries, do not keep
+        # writers waiting, see archive_transactions
+        c.execute("PRAGMA journal_mode = WAL")
     except sqlite3.Error as e:
         print(e, file=sys.stderr)
 
-def create_transaction(conn, transaction):
+def upgrade_transactions_table(conn, schema="main"):
+    """Adds columns and indexes missing from 'transactions' tables created by
+    earlier versions of the program.
+
+    Parameters:
+        conn (Connection): Connection object
+        schema (string): Name of the attached database holding the table
+    """
+    cur = conn.cursor()
+    columns = [row[1] for row in cur.execute(f"PRAGMA {schema}.table_info(transactions)")]
+    if "fingerprint" not in columns:
+        cur.execute(f"ALTER TABLE {schema}.transactions ADD COLUMN fingerprint text")
+    if "deleted_at" not in columns:
+        cur.execute(f"ALTER TABLE {schema}.transactions ADD COLUMN deleted_at text")
+    if "account_id" not in columns:
+        cur.execute(f"ALTER TABLE {schema}.transactions ADD COLUMN account_id integer")
+        cur.execute(f"UPDATE {schema}.transactions SET account_id = ?",
+                    (DEFAULT_ACCOUNT_ID,))
+    if "recurring_id" not in columns:
+        cur.execute(f"ALTER TABLE {schema}.transactions ADD COLUMN recurring_id integer")
+    if schema == "main":
+        cur.execute('''SELECT sql FROM main.sqlite_master
+                        WHERE type = 'table' AND name = 'transactions' ''')
+        if "AUTOINCREMENT" not in cur.fetchone()[0].upper():
+            rebuild_transactions_table(conn)
+    cur.execute(f'''UPDATE {schema}.transactions
+                    SET fingerprint = fingerprint(date, value, currency, desc)
+                    WHERE fingerprint IS NULL ''')
+    cur.execute(f'''CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_fingerprint
+                    ON transactions(fingerprint) ''')
+    # entries marked as deleted are left out of the date index
+    cur.execute(f"DROP INDEX IF EXISTS {schema}.idx_transactions_date")
+    cur.execute(f'''CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_live_date
+                    ON transactions(date) WHERE deleted_at IS NULL ''')
+    cur.execute(f'''CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_live_account
+                    ON transactions(account_id, date) WHERE deleted_at IS NULL ''')
+    # entries sorted by a column are read in index order, ties in order of id
+    for column in SORT_COLUMNS[1:]:
+        cur.execute(f'''CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_live_{column}
+                        ON transactions("{column}") WHERE deleted_at IS NULL ''')
+    if schema != "main":
+        return
+    # lets purge_deleted_transactions find entries deleted long ago without
+    # reading the whole table, entries of archives are found by their id
+    cur.execute('''CREATE INDEX IF NOT EXISTS main.idx_transactions_deleted
+                    ON transactions(deleted_at) WHERE deleted_at IS NOT NULL ''')
+    # entries changed or deleted are counted, so that copies of the table can
+    # tell if new entries are all that changed, see count_transaction_changes
+    cur.execute('''CREATE TABLE IF NOT EXISTS main.transaction_changes (
+                        changes integer
+                    ) ''')
+    cur.execute('''INSERT INTO main.transaction_changes
+                    SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM main.transaction_changes) ''')
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS main.transaction_changes_delete
+                    AFTER DELETE ON transactions
+                    WHEN OLD.deleted_at IS NULL
+                    BEGIN
+                        UPDATE transaction_changes SET changes = changes + 1;
+                    END ''')
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS main.transaction_changes_update
+                    AFTER UPDATE OF id, date, value, currency, categ, account_id, deleted_at
+                    ON transactions
+                    BEGIN
+                        UPDATE transaction_changes SET changes = changes + 1;
+                    END ''')
+
+def count_transaction_changes(conn):
+    """Returns number of changes and deletions of entries counted by
+    triggers of 'transactions' table of the main database. Entries added are
+    not counted, they are told apart by their id's, which only grow. Entries
+    deleted or restored in archive databases are counted by rollup_archive,
+    so archives are not attached.
+
+    Parameters:
+        conn (Connection): Connection object
+    Returns:
+        int: Number of changes
+    """
+    return conn.execute("SELECT changes FROM main.transaction_changes").fetchone()[0]
+
+def rebuild_transactions_table(conn):
+    """Copies 'transactions' table of the main database created by earlier
+    versions of the program into a table with AUTOINCREMENT id's, so that
+    id's of entries moved to archive databases are never given to new
+    entries. New id's start after the highest id of the main and archive
+    databases.
+
+    Parameters:
+        conn (Connection): Connection object
+    """
+    conn.commit()
+    cur = conn.cursor()
+    cur.execute("SELECT MAX(id) FROM main.transactions")
+    highest = cur.fetchone()[0] or 0
+    for year in archived_years(conn, "0000", "9999"):
+        schema = f"archive_{year}"
+        if attach_archive(conn, schema):
+            cur.execute(f"SELECT MAX(id) FROM {schema}.transactions")
+            highest = max(highest, cur.fetchone()[0] or 0)
+            detach_archives(conn, [schema])
+    columns = ("id, date, value, currency, desc, categ, fingerprint, deleted_at, "
+               "account_id, recurring_id")
+    # indexes and triggers of the old table are dropped with it and created
+    # again by upgrade_transactions_table and create_transactions_table
+    cur.execute("ALTER TABLE main.transactions RENAME TO transactions_old")
+    cur.execute(SQL_CREATE_TRANSACTIONS_TABLE.format(schema="main"))
+    cur.execute(f'''INSERT INTO main.transactions({columns})
+                    SELECT {columns} FROM main.transactions_old ''')
+    cur.execute("DROP TABLE main.transactions_old")
+    cur.execute('''UPDATE main.sqlite_sequence SET seq = MAX(seq, ?)
+                    WHERE name = 'transactions' ''', (highest,))
+    if not cur.rowcount:
+        cur.execute("INSERT INTO main.sqlite_sequence(name, seq) VALUES('transactions', ?)",
+                    (highest,))
+
+def database_path(conn):
+    """Returns path of the main database file of the connection.
+
+    Parameters:
+        conn (Connection): Connection object
+    Returns:
+        string: Path to database file, empty for in-memory databases
+    """
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return path
+    return ""
+
+def archived_years(conn, date_from, date_to):
+    """Returns years between dates given stored in archive databases.
+
+    Parameters:
+        conn (Connection): Connection object
+        date_from (string): Earliest date needed
+        data_to (string): Latest date needed
+    Returns:
+        list: Archived years, oldest first
+    """
+    try:
+        return [row[0] for row in conn.execute('''SELECT year FROM main.archive_partitions
+                                                  WHERE year BETWEEN ? AND ?
+                                                  ORDER BY year ''',
+                                               (int(str(date_from)[:4]),
+                                                int(str(date_to)[:4])))]
+    except sqlite3.OperationalError as e:
+        if str(e) == "no such table: main.archive_partitions":
+            return []
+        raise
+
+def attach_archive(conn, schema):
+    """Attaches archive database of a year unless it is attached already.
+
+    Parameters:
+        conn (Connection): Connection object
+        schema (string): Name of the archive database, e.g. archive_2015
+    Returns:
+        bool: True if the archive is attached, False if the year is not
+            archived or its database file is missing
+    """
+    if schema in [row[1] for row in conn.execute("PRAGMA database_list")]:
+        return True
+    year = schema[len("archive_"):]
+    if not schema.startswith("archive_") or not year.isdigit():
+        return False
+    row = conn.execute("SELECT path FROM main.archive_partitions WHERE year = ?",
+                       (int(year),)).fetchone()
+    if row is None:
+        return False
+    path = os.path.join(os.path.dirname(database_path(conn)), row[0])
+    if not os.path.exists(path):
+        print(f"Archive database {path} not found", file=sys.stderr)
+        return False
+    conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+    upgrade_transactions_table(conn, schema)
+    conn.commit()
+    return True
+
+def detach_archives(conn, schemas):
+    """Detaches archive databases. Changes must be committed and queries
+    reading the archives finished first.
+
+    Parameters:
+        conn (Connection): Connection object
+        schemas (list): Names of attached archive databases
+    """
+    for schema in schemas:
+        conn.execute(f"DETACH DATABASE {schema}")
+
+def archive_groups(conn, date_from, date_to):
+    """Splits date interval into parts overlapping at most
+    MAX_ATTACHED_ARCHIVES archived years each and yields them in order of
+    date with archive databases of the part attached. They are detached
+    before the next part is yielded, so queries reading them must be read
+    to the end or closed by then.
+
+    Parameters:
+        conn (Connection): Connection object
+        date_from (string): Earliest date needed
+        data_to (string): Latest date needed
+    Yields:
+        tuple: (string): first date of the part, (string): last date of the
+            part, (list): schema names of its attached archive databases
+    """
+    years = archived_years(conn, date_from, date_to)
+    groups = [years[start:start + MAX_ATTACHED_ARCHIVES]
+              for start in range(0, len(years), MAX_ATTACHED_ARCHIVES)] or [[]]
+    for number, group in enumerate(groups):
+        part_from = date_from if number == 0 else f"{group[0]:04d}-01-01"
+        # day 32 sorts after any time of the last day of the year
+        part_to = (date_to if number == len(groups) - 1
+                   else f"{groups[number + 1][0] - 1:04d}-12-32")
+        schemas = [f"archive_{year}" for year in group
+                   if attach_archive(conn, f"archive_{year}")]
+        try:
+            yield part_from, part_to, schemas
+        finally:
+            detach_archives(conn, schemas)
+
+def archive_transactions(conn, cutoff):
+    """Moves entries older than cutoff date from 'transactions' table to
+    per-year archive databases and stores monthly totals of archived years
+    in 'monthly_rollups' table, see rollup_archive. Entries keep their id's,
+    which are not given to new entries, see rebuild_transactions_table.
+    Transactions spanning the main database in WAL mode and an archive are
+    not atomic, so entries are copied to the archive first and removed from
+    the main database in a second transaction. Entries already copied are
+    skipped, so running it again after a crash completes the move.
+
+    Parameters:
+        conn (Connection): Connection object
+        cutoff (string): Entries dated before this date are archived
+    Returns:
+        dict: Number of entries archived for each year
+    """
+    conn.commit()
+    cur = conn.cursor()
+    cur.execute('''SELECT DISTINCT substr(date, 1, 4) FROM transactions
+                    WHERE date < ?
+                    ORDER BY 1 ''', (cutoff,))
+    years = [row[0] for row in cur.fetchall()]
+    stem = os.path.splitext(os.path.basename(database_path(conn)))[0]
+    directory = os.path.dirname(database_path(conn))
+    archived = {}
+    for year in years:
+        schema = f"archive_{year}"
+        file_name = f"{stem}_{year}.db"
+        if not attach_archive(conn, schema):
+            cur.execute(f"ATTACH DATABASE ? AS {schema}",
+                        (os.path.join(directory, file_name),))
+        year_end = min(cutoff, f"{int(year)+1:04d}-01-01")
+        with conn:
+            cur.execute(SQL_CREATE_TRANSACTIONS_TABLE.format(schema=schema))
+            upgrade_transactions_table(conn, schema)
+            cur.execute(f'''INSERT OR IGNORE INTO {schema}.transactions
+                                ({TRANSACTION_COLUMNS}, fingerprint, deleted_at)
+                            SELECT {TRANSACTION_COLUMNS}, fingerprint, deleted_at
+                            FROM main.transactions
+                            WHERE date >= ? AND date < ? ''', (f"{year}-01-01", year_end))
+        with conn:
+            # deleted entries are restored from the archive from now on
+            cur.execute('''UPDATE undo_journal SET source = ?
+                            WHERE source = 'main'
+                            AND transaction_id IN (SELECT id FROM main.transactions
+                                                   WHERE date >= ? AND date < ?) ''',
+                        (schema, f"{year}-01-01", year_end))
+            cur.execute('''DELETE FROM main.transactions
+                            WHERE date >= ? AND date < ? ''', (f"{year}-01-01", year_end))
+            archived[year] = cur.rowcount
+            # triggers took the moved entries off the spend counters, their
+            # totals are read from 'monthly_rollups' from now on
+            cur.execute("DELETE FROM spend_counters WHERE entries = 0")
+            rollup_archive(conn, schema)
+            cur.execute(f'''INSERT OR REPLACE INTO archive_partitions
+                            VALUES (?, ?, (SELECT COUNT(*) FROM {schema}.transactions)) ''',
+                        (int(year), file_name))
+        # a connection can only attach a few databases
+        detach_archives(conn, [schema])
+    if archived:
+        cur.execute("VACUUM")
+    return archived
+
+def rollup_archive(conn, schema):
+    """Stores monthly totals of live entries of an archive database in
+    'monthly_rollups' table, replacing totals stored before, and counts the
+    change, see count_transaction_changes. Called whenever entries of the
+    archive are added, deleted or restored.
+
+    Parameters:
+        conn (Connection): Connection object
+        schema (string): Name of the attached archive database, e.g. archive_2015
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM main.monthly_rollups WHERE month LIKE ?",
+                (f"{schema[len('archive_'):]}-%",))
+    cur.execute(f'''INSERT INTO main.monthly_rollups(month, currency, categ, total, entries)
+                    SELECT substr(date, 1, 7), IFNULL(currency, ''), IFNULL(categ, ''),
+                           SUM(value), COUNT(*)
+                    FROM {schema}.transactions
+                    WHERE deleted_at IS NULL
+                    GROUP BY 1, 2, 3 ''')
+    cur.execute("UPDATE main.transaction_changes SET changes = changes + 1")
+
+def transaction_fingerprint(date, value, currency, desc):
+    """Returns content fingerprint of a transaction. Date, value, currency and
+    description are normalized first, so that the same transaction imported
+    twice gets the same fingerprint.
+
+    Parameters:
+        date (string or datetime.date): Date of transaction
+        value (float): Amount of transaction
+        currency (string): Currency symbol
+        desc (string): Description
+    Returns:
+        string: Hex digest identifying the transaction contents
+    """
+    normalized = "\x1f".join((str(date)[:10].replace("/", "-"),
+                              f"{float(value):.2f}",
+                              str(currency).strip(),
+                              " ".join(str(desc).split()).lower()))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def create_transaction(conn, transaction, skip_duplicates=False,
+                       account_id=DEFAULT_ACCOUNT_ID):
     """Create a new entry into the 'transactions' table.
 
     Parameters:
         conn (Connection): Connection object
         transaction (Tuple): Tuple containing data to be inserted to table
+        skip_duplicates (bool): If True, entry is not inserted when the
+            account already has a transaction with the same fingerprint
+        account_id (int): Id of account the entry belongs to
+    Returns:
+        bool: True if entry was inserted, False if it was skipped
+    """
+    fingerprint = transaction_fingerprint(*transaction[:4])
+    cur = conn.cursor()
+    if skip_duplicates:
+        # unary + keeps the planner on the fingerprint index instead of
+        # scanning the whole account through idx_transactions_live_account
+        sql = ''' INSERT INTO transactions(date, value, currency, desc, categ,
+                                           fingerprint, account_id)
+                  SELECT ?, ?, ?, ?, ?, ?, ?
+                  WHERE NOT EXISTS (SELECT 1 FROM transactions
+                                    WHERE fingerprint = ? AND +account_id = ?
+                                    AND deleted_at IS NULL) '''
+        cur.execute(sql, (*transaction, fingerprint, account_id, fingerprint, account_id))
+        return cur.rowcount > 0
+    sql = ''' INSERT INTO transactions(date, value, currency, desc, categ,
+                                       fingerprint, account_id)
+              VALUES(?, ?, ?, ?, ?, ?, ?) '''
+    cur.execute(sql, (*transaction, fingerprint, account_id))
+    return True
+
+def create_transactions(conn, transactions, skip_duplicates=True,
+                        account_id=DEFAULT_ACCOUNT_ID):
+    """Create new entries into the 'transactions' table, e.g. from an imported
+    statement.
+
+    Parameters:
+        conn (Connection): Connection object
+        transactions (list): List of tuples containing data to be inserted
+        skip_duplicates (bool): If True, entries are matched copy by copy
+            with entries of the account already in the table, so that the
+            same transaction made twice on one day is inserted twice unless
+            the table already holds both copies
+        account_id (int): Id of account the entries belong to
+    Returns:
+        list of tuples: Entries that were skipped as duplicates
+    """
+    skipped = []
+    # copies of each fingerprint in the table not yet matched by an entry
+    unmatched = {}
+    cur = conn.cursor()
+    for transaction in transactions:
+        if skip_duplicates:
+            fingerprint = transaction_fingerprint(*transaction[:4])
+            if fingerprint not in unmatched:
+                # unary + keeps the planner on the fingerprint index, see
+                # create_transaction
+                cur.execute('''SELECT COUNT(*) FROM transactions
+                               WHERE fingerprint = ? AND +account_id = ?
+                               AND deleted_at IS NULL ''', (fingerprint, account_id))
+                unmatched[fingerprint] = cur.fetchone()[0]
+            if unmatched[fingerprint]:
+                unmatched[fingerprint] -= 1
+                skipped.append(transaction)
+                continue
+        create_transaction(conn, transaction, False, account_id)
+    return skipped
+
+def create_account(conn, name):
+    """Create a new entry into the 'accounts' table.
+
+    Parameters:
+        conn (Connection): Connection object
+        name (string): Name of the account
+    Returns:
+        int: Id of the account
+    """
+    cur = conn.cursor()
+    cur.execute("INSERT INTO accounts(name) VALUES(?)", (name,))
+    return cur.lastrowid
+
+def select_accounts(conn):
+    """Selects all entries of 'accounts' table.
+
+    Parameters:
+        conn (Connection): Connection object
+    Returns:
+        list of tuples: (id, name) of each account
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT id, name FROM accounts ORDER BY id")
+    return cur.fetchall()
+
+def recurring_dates(start_date, period, every=1):
+    """Yields dates of occurrences of a recurring transaction, without end.
+    Monthly and yearly occurrences fall on the day of start date, or on the
+    last day of shorter months.
+
+    Parameters:
+        start_date (string): Date of first occurrence in YYYY-MM-DD format
+        period (string): One of RECURRING_PERIODS
+        every (int): Number of periods between occurrences
+    Yields:
+        string: Date in YYYY-MM-DD format
+    """
+    start = datetime.date.fromisoformat(start_date[:10])
+    occurrence = 0
+    while True:
+        if period == "daily":
+            date = start + datetime.timedelta(days=occurrence*every)
+        elif period == "weekly":
+            date = start + datetime.timedelta(weeks=occurrence*every)
+        else:
+            months = occurrence*every*(12 if period == "yearly" else 1)
+            year, month = divmod(start.month - 1 + months, 12)
+            year += start.year
+            date = datetime.date(year, month + 1,
+                                 min(start.day, calendar.monthrange(year, month + 1)[1]))
+        yield date.isoformat()
+        occurrence += 1
+
+def create_recurring_transaction(conn, transaction, period, every=1, start_date=None,
+                                 end_date=None, account_id=DEFAULT_ACCOUNT_ID):
+    """Create a new entry into the 'recurring_transactions' table. Entries of
+    'transactions' table are created from it for occurrences up to today by
+    materialize_recurring_transactions, later occurrences are only shown,
+    see forecast_recurring_transactions.
+
+    Parameters:
+        conn (Connection): Connection object
+        transaction (Tuple): date, value, currency, desc and categ of the
+            first occurrence
+        period (string): One of RECURRING_PERIODS
+        every (int): Number of periods between occurrences
+        start_date (string): Date of first occurrence, date of transaction if None
+        end_date (string): Date after which there are no occurrences, never if None
+        account_id (int): Id of account the entries belong to
+    Returns:
+        int: Id of the recurring transaction
+    """
+    if period not in RECURRING_PERIODS:
+        raise ValueError(f"Unknown period '{period}'")
+    if every < 1:
+        raise ValueError("Recurring transaction has to repeat every 1 or more periods")
+    start_date = f"{start_date or transaction[0]}"
+    # raises ValueError for dates not in YYYY-MM-DD format
+    datetime.date.fromisoformat(start_date[:10])
+    cur = conn.cursor()
+    cur.execute(''' INSERT INTO recurring_transactions(value, currency, desc, categ,
+                                                      account_id, period, every,
+                                                      start_date, end_date)
+                     VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?) ''',
+                (*transaction[1:5], account_id, period, every, start_date, end_date))
+    return cur.lastrowid
+
+def select_recurring_transactions(conn):
+    """Selects entries of 'recurring_transactions' table not deleted.
+
+    Parameters:
+        conn (Connection): Connection object
+    Returns:
+        list of tuples: (id, value, currency, desc, categ, account_id, period,
+            every, start_date, end_date, materialized_through) of each entry
+    """
+    cur = conn.cursor()
+    cur.execute('''SELECT id, value, currency, desc, categ, account_id, period, every,
+                          start_date, end_date, materialized_through
+                   FROM recurring_transactions
+                   WHERE deleted_at IS NULL
+                   ORDER BY id ''')
+    return cur.fetchall()
+
+def delete_recurring_transaction(conn, recurring_id, after=None):
+    """Marks an entry of 'recurring_transactions' table and its occurrences
+    dated after date given as deleted. Both are recorded in the same batch
+    of 'undo_journal' table, so undo_delete restores the schedule together
+    with its occurrences.
+
+    Parameters:
+        conn (Connection): Connection object
+        recurring_id (int): Id of the recurring transaction
+        after (string): Occurrences up to this date are kept, today if None
+    Returns:
+        int: Batch of deleted entries, see delete_transactions
+    """
+    after = after or datetime.date.today().isoformat()
+    cur = conn.cursor()
+    cur.execute('''UPDATE recurring_transactions SET deleted_at = datetime('now')
+                   WHERE id = ? AND deleted_at IS NULL ''', (recurring_id,))
+    if not cur.rowcount:
+        raise ValueError(f"Unknown recurring transaction {recurring_id}")
+    cur.execute('''SELECT id FROM transactions
+                   WHERE recurring_id = ? AND date > ? AND deleted_at IS NULL ''',
+                (recurring_id, after))
+    ids = [row[0] for row in cur.fetchall()]
+    batch = delete_transactions(conn, [("main", id) for id in ids])
+    cur.execute('''INSERT INTO undo_journal(batch, source, transaction_id, deleted_at)
+                   VALUES(?, ?, ?, datetime('now')) ''', (batch, RECURRING_SOURCE, recurring_id))
+    conn.commit()
+    return batch
+
+def materialize_recurring_transactions(conn, through):
+    """Creates entries of 'transactions' table for occurrences of recurring
+    transactions up to date given, but not after today. Each recurring
+    transaction remembers the date it was created up to, so occurrences are
+    created once and deleted occurrences are not created again. Functions
+    reading entries do not call this, so that they never write to the
+    database, see forecast_recurring_transactions.
+
+    Parameters:
+        conn (Connection): Connection object
+        through (string): Latest date to create occurrences for
+    Returns:
+        int: Number of entries created
+    """
+    through = min(f"{through}"[:10], datetime.date.today().isoformat())
+    cur = conn.cursor()
+    try:
+        cur.execute('''SELECT id, value, currency, desc, categ, account_id, period,
+                              every, start_date, end_date, materialized_through
+                       FROM main.recurring_transactions
+                       WHERE (materialized_through IS NULL OR materialized_through < ?)
+                       AND start_date <= ? AND deleted_at IS NULL ''', (through, through))
+    except sqlite3.OperationalError:
+        # database made by an older version, see create_transactions_table
+        return 0
+    created = 0
+    due = cur.fetchall()
+    for (recurring_id, value, currency, desc, categ, account_id, period, every,
+         start_date, end_date, materialized_through) in due:
+        last = min(through, end_date) if end_date else through
+        entries = []
+        for date in recurring_dates(start_date, period, every):
+            if date > last:
+                break
+            if materialized_through is None or date > materialized_through:
+                entries.append((date, value, currency, desc, categ,
+                                transaction_fingerprint(date, value, currency, desc),
+                                account_id, recurring_id))
+        cur.executemany(''' INSERT INTO main.transactions(date, value, currency, desc, categ,
+                                                          fingerprint, account_id,
+                                                          recurring_id)
+                             VALUES(?, ?, ?, ?, ?, ?, ?, ?) ''', entries)
+        cur.execute('''UPDATE main.recurring_transactions SET materialized_through = ?
+                       WHERE id = ? ''', (through, recurring_id))
+        created += len(entries)
+    if due:
+        conn.commit()
+    return created
+
+def forecast_recurring_transactions(conn, date_from, date_to):
+    """Fills temporary 'recurring_forecast' table of the connection with
+    occurrences of recurring transactions between dates given that are not
+    stored in 'transactions' table yet, see materialize_recurring_transactions.
+    Functions reading entries call this first and read the table along with
+    stored entries, so future occurrences are shown without being stored.
+    Occurrences more than RECURRING_FORECAST_YEARS years ahead are left out.
+
+    Parameters:
+        conn (Connection): Connection object
+        date_from (string): Earliest date to forecast occurrences for
+        data_to (string): Latest date to forecast occurrences for
+    Returns:
+        int: Number of occurrences forecast
+    """
+    horizon = (datetime.date.today()
+               + datetime.timedelta(days=365*RECURRING_FORECAST_YEARS)).isoformat()
+    date_from = f"{date_from}"[:10]
+    last = min(f"{date_to}"[:10], horizon)
+    cur = conn.cursor()
+    cur.execute(SQL_CREATE_FORECAST_TABLE)
+    cur.execute("DELETE FROM temp.recurring_forecast")
+    try:
+        cur.execute('''SELECT id, value, currency, desc, categ, account_id, period,
+                              every, start_date, end_date, materialized_through
+                       FROM main.recurring_transactions
+                       WHERE (materialized_through IS NULL OR materialized_through < ?)
+                       AND (end_date IS NULL OR end_date >= ?)
+                       AND start_date <= ? AND deleted_at IS NULL ''',
+                    (last, date_from, last))
+        due = cur.fetchall()
+    except sqlite3.OperationalError:
+        # database made by an older version, see create_transactions_table
+        due = []
+    entries = []
+    for (recurring_id, value, currency, desc, categ, account_id, period, every,
+         start_date, end_date, materialized_through) in due:
+        end = min(last, end_date) if end_date else last
+        for date in recurring_dates(start_date, period, every):
+            if date > end:
+                break
+            if date >= date_from and (materialized_through is None
+                                      or date > materialized_through):
+                entries.append((recurring_id, date, value, currency, desc, categ,
+                                account_id))
+    cur.executemany('''INSERT INTO temp.recurring_forecast(id, date, value, currency,
+                                                          desc, categ, account_id)
+                       VALUES(?, ?, ?, ?, ?, ?, ?) ''', entries)
+    # ends the transaction begun for the temporary table, which would keep
+    # other connections from writing while the caller reads
+    conn.commit()
+    return len(entries)
+
+def rebuild_spend_counters(conn):
+    """Recomputes 'spend_counters' table from live entries of the main
+    database. Triggers keep the counters up to date afterwards.
+
+    Parameters:
+        conn (Connection): Connection object
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM spend_counters")
+    cur.execute('''INSERT INTO spend_counters(month, categ, currency, total, entries)
+                   SELECT substr(date, 1, 7), IFNULL(categ, ''), IFNULL(currency, ''),
+                          SUM(value), COUNT(*)
+                   FROM transactions
+                   WHERE deleted_at IS NULL
+                   GROUP BY 1, 2, 3 ''')
+
+def set_budget(conn, categ, monthly_limit):
+    """Sets monthly limit of expenses of a category.
+
+    Parameters:
+        conn (Connection): Connection object
+        categ (string): Category of the budget
+        monthly_limit (float): Limit in GBP(£), budget is removed if None
+    """
+    cur = conn.cursor()
+    if monthly_limit is None:
+        cur.execute("DELETE FROM budgets WHERE categ = ?", (categ,))
+    else:
+        cur.execute("INSERT OR REPLACE INTO budgets(categ, monthly_limit) VALUES(?, ?)",
+                    (categ, monthly_limit))
+
+def select_budgets(conn):
+    """Selects all entries of 'budgets' table.
+
+    Parameters:
+        conn (Connection): Connection object
+    Returns:
+        dict: Monthly limit in GBP(£) by category
     """
-    sql = ''' INSERT INTO transactions(date, value, currency, desc, categ)
-              VALUES(?, ?, ?, ?, ?) '''
     cur = conn.cursor()
-    cur.execute(sql, transaction)
+    cur.execute("SELECT categ, monthly_limit FROM budgets")
+    return dict(cur.fetchall())
+
+def get_category_spend(conn, month):
+    """Returns expenses of each category in a month, read from
+    'spend_counters' table and, for archived months, 'monthly_rollups' table.
+
+    Parameters:
+        conn (Connection): Connection object
+        month (string): Month in YYYY-MM format
+    Returns:
+        dict: Expenses in GBP(£) by category, income counted as negative
+    """
+    cur = conn.cursor()
+    cur.execute('''SELECT categ, currency, total FROM spend_counters WHERE month = ?
+                   UNION ALL
+                   SELECT categ, currency, total FROM monthly_rollups WHERE month = ? ''',
+                (month, month))
+    spend = {}
+    for categ, currency, total in cur.fetchall():
+        spend[categ] = spend.get(categ, 0) - total*CURRENCY_RATES.get(currency, 1)
+    return spend
+
+def get_budget_usage(conn, categ, month):
+    """Returns expenses and limit of a category in a month. Reads one entry
+    of 'budgets' table and one entry of 'spend_counters' and
+    'monthly_rollups' tables per currency, however many entries the month has.
+
+    Parameters:
+        conn (Connection): Connection object
+        categ (string): Category of the budget
+        month (string): Month in YYYY-MM format
+    Returns:
+        tuple: (float): expenses in GBP(£), (float): limit in GBP(£), or
+            None if the category has no budget
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT monthly_limit FROM budgets WHERE categ = ?", (categ,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    cur.execute('''SELECT currency, total FROM spend_counters
+                   WHERE month = ? AND categ = ?
+                   UNION ALL
+                   SELECT currency, total FROM monthly_rollups
+                   WHERE month = ? AND categ = ? ''', (month, categ, month, categ))
+    spent = -sum(total*CURRENCY_RATES.get(currency, 1) for currency, total in cur.fetchall())
+    return spent, row[0]
+
+def find_duplicate_transactions(conn):
+    """Finds groups of entries in 'transactions' table sharing a fingerprint.
+
+    Parameters:
+        conn (Connection): Connection object
+    Returns:
+        list of tuples: (fingerprint, id kept, number of copies, all ids)
+            for every group of duplicates
+    """
+    cur = conn.cursor()
+    cur.execute('''SELECT fingerprint, MIN(id), COUNT(*), GROUP_CONCAT(id)
+                    FROM transactions
+                    WHERE deleted_at IS NULL
+                    GROUP BY fingerprint, account_id
+                    HAVING COUNT(*) > 1 ''')
+    return cur.fetchall()
+
+def merge_duplicate_transactions(conn):
+    """Merges duplicated entries of 'transactions' table, keeping the earliest
+    inserted entry of each group. The other entries are deleted with
+    delete_transactions, so a merge can be reverted with undo_delete.
+
+    Parameters:
+        conn (Connection): Connection object
+    Returns:
+        tuple: (int): Number of entries removed, (int): batch to pass to
+            undo_delete
+    """
+    cur = conn.cursor()
+    cur.execute('''SELECT id FROM transactions
+                    WHERE deleted_at IS NULL
+                    AND id NOT IN (SELECT MIN(id) FROM transactions
+                                   WHERE deleted_at IS NULL
+                                   GROUP BY fingerprint, account_id) ''')
+    ids = [row[0] for row in cur.fetchall()]
+    return len(ids), delete_transactions(conn, [("main", id) for id in ids])
+
+def run_maintenance(conn):
+    """Refreshes query planner statistics, returns free pages to the system
+    and checks integrity of the database. Each step is a short transaction,
+    so it can run while the program holds its own connection.
+
+    Parameters:
+        conn (Connection): Connection object
+    Returns:
+        dict: 'Integrity' check messages, database 'Pages', 'Free pages' and
+            'Page size' before and after, 'Entries' per table and 'Indexes'
+            with their size and, for indexes of 'transactions' table,
+            whether the program's queries use them
+    """
+    conn.commit()
+    cur = conn.cursor()
+    report = {"Pages before": cur.execute("PRAGMA page_count").fetchone()[0],
+              "Free pages before": cur.execute("PRAGMA freelist_count").fetchone()[0]}
+    cur.execute("ANALYZE")
+    conn.commit()
+    cur.execute("PRAGMA optimize")
+    if cur.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        # executescript runs the pragma to the end, execute frees one page
+        conn.executescript("PRAGMA incremental_vacuum")
+    report["Integrity"] = [row[0] for row in cur.execute("PRAGMA integrity_check")]
+    report["Pages"] = cur.execute("PRAGMA page_count").fetchone()[0]
+    report["Free pages"] = cur.execute("PRAGMA freelist_count").fetchone()[0]
+    report["Page size"] = cur.execute("PRAGMA page_size").fetchone()[0]
+
+    tables = [row[0] for row in cur.execute('''SELECT name FROM sqlite_master
+                                                WHERE type = 'table'
+                                                AND name NOT LIKE 'sqlite_%'
+                                                ORDER BY name ''')]
+    report["Entries"] = {table: cur.execute(f"SELECT COUNT(*) FROM \"{table}\"").fetchone()[0]
+                         for table in tables}
+
+    # indexes chosen by the query planner for pages of the table the program
+    # shows for the last month: unfiltered, filtered by category, search,
+    # value range or account, sorted by each column through its index as
+    # select_transactions does, and for the duplicate check of imports
+    date_to = datetime.date.today()
+    date_from = (date_to - datetime.timedelta(days=31)).isoformat()
+    date_to = date_to.isoformat()
+    queries = [sorted_transactions_query(conn, date_from, date_to, *args,
+                                         accounts=accounts, limit=MAINTENANCE_PAGE_SIZE)
+               for args, accounts in (((), None),
+                                      (("Groceries",), None),
+                                      (("All", "shop"), None),
+                                      ((0, 100, "All"), None),
+                                      (("All",), [DEFAULT_ACCOUNT_ID]))]
+    for column in SORT_COLUMNS[1:]:
+        queries.append(sorted_transactions_query(conn, date_from, date_to, "All",
+                                                 order_by=column,
+                                                 limit=MAINTENANCE_PAGE_SIZE,
+                                                 index=f"idx_transactions_live_{column}"))
+    queries.append(('''SELECT COUNT(*) FROM transactions
+                       WHERE fingerprint = ? AND +account_id = ?
+                       AND deleted_at IS NULL ''', ["", DEFAULT_ACCOUNT_ID]))
+    queries.append(('''SELECT id FROM main.transactions
+                       WHERE deleted_at < datetime('now', ?)
+                       LIMIT ? ''', ["-30 days", MAINTENANCE_PAGE_SIZE]))
+    used = set()
+    for sql, query_params in queries:
+        for row in cur.execute("EXPLAIN QUERY PLAN " + sql, query_params):
+            used.update(word for word in row[-1].split() if word.startswith("idx_"))
+    statistics = dict(cur.execute("SELECT idx, stat FROM sqlite_stat1 WHERE idx IS NOT NULL"))
+    report["Indexes"] = {}
+    for name, table in cur.execute('''SELECT name, tbl_name FROM sqlite_master
+                                       WHERE type = 'index'
+                                       ORDER BY tbl_name, name ''').fetchall():
+        stat = statistics.get(name)
+        # only queries of 'transactions' are checked
+        report["Indexes"][name] = {"Table": table,
+                                   "Entries": int(stat.split()[0]) if stat else 0,
+                                   "Used": name in used if table == "transactions" else None}
+    return report
+
+def format_maintenance_report(report):
+    """Returns report of run_maintenance as text.
+
+    Parameters:
+        report (dict): Report returned by run_maintenance
+    Returns:
+        string: Text to be printed or shown to the user
+    """
+    lines = [f"Integrity check: {', '.join(report['Integrity'])}",
+             f"Pages: {report['Pages before']} -> {report['Pages']} "
+             f"({report['Page size']} bytes each)",
+             f"Free pages: {report['Free pages before']} -> {report['Free pages']}",
+             "Entries:"]
+    for table, entries in report["Entries"].items():
+        lines.append(f"    {table}: {entries}")
+    lines.append("Indexes:")
+    for name, index in report["Indexes"].items():
+        line = f"    {name} on {index['Table']}: {index['Entries']} entries"
+        if index["Used"] is not None:
+            line += ", " + ("used" if index["Used"] else "not used by common queries")
+        lines.append(line)
+    return "\n".join(lines)
 
 def main():
-    database = "transaction_database.db"
-    sql_create_transactions_table = """ CREATE TABLE IF NOT EXISTS transactions (
-                                        id integer PRIMARY KEY,
-                                        date text,
-                                        value float,
-                                        currency text,
-                                        desc text,
-                                        categ text
-                                    ); """
+    parser = argparse.ArgumentParser(description="Budget Tracker database tools")
+    parser.add_argument("--database", default="transaction_database.db",
+                        help="path to database file")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("init", help="create or upgrade 'transactions' table")
+    dedupe_parser = subparsers.add_parser(
+        "dedupe", help="find and merge duplicated transactions")
+    dedupe_parser.add_argument("--dry-run", action="store_true",
+                               help="only list duplicates, do not merge them")
+    undo_parser = subparsers.add_parser(
+        "undo", help="restore transactions deleted together")
+    undo_parser.add_argument("--batch", type=int,
+                             help="batch of deleted transactions, latest if not given")
+    archive_parser = subparsers.add_parser(
+        "archive", help="move old transactions to per-year archive databases")
+    archive_parser.add_argument("--before", required=True,
+                                help="archive transactions dated before YYYY-MM-DD")
+    subparsers.add_parser("maintenance",
+                          help="analyze, compact and check integrity of the database")
+    recurring_parser = subparsers.add_parser(
+        "recurring", help="list or delete recurring transactions")
+    recurring_parser.add_argument("--delete", type=int, metavar="ID",
+                                  help="delete recurring transaction and its future entries")
+    budget_parser = subparsers.add_parser(
+        "budget", help="show or set monthly limits of expenses by category")
+    budget_parser.add_argument("--set", nargs=2, metavar=("CATEGORY", "LIMIT"),
+                               help="set monthly limit in GBP, 'none' removes it")
+    budget_parser.add_argument("--month", default=datetime.date.today().isoformat()[:7],
+                               help="month to show expenses of, YYYY-MM")
+    args = parser.parse_args()
 
     # create a database connection
-    conn = create_connection(database)
+    conn = create_connection(args.database)
 
     if conn is not None:
         # create transactions table
         with conn:
-            create_table(conn, sql_create_transactions_table)
+            create_transactions_table(conn)
+
+        if args.command == "dedupe":
+            duplicates = find_duplicate_transactions(conn)
+            for fingerprint, kept_id, copies, ids in duplicates:
+                print(f"{copies} copies of entry {kept_id} (ids: {ids})")
+            if not duplicates:
+                print("No duplicates found")
+            elif not args.dry_run:
+                removed, batch = merge_duplicate_transactions(conn)
+                print(f"Removed {removed} duplicated entries, to restore them run "
+                      f"'backend.py undo --batch {batch}'")
+        elif args.command == "undo":
+            restored = undo_delete(conn, args.batch)
+            print(f"Restored {sum(source != RECURRING_SOURCE for source, _ in restored)} "
+                  "entries")
+        elif args.command == "archive":
+            archived = archive_transactions(conn, args.before)
+            for year, entries in archived.items():
+                print(f"Archived {entries} entries from {year}")
+            if not archived:
+                print("Nothing to archive")
+        elif args.command == "maintenance":
+            print(format_maintenance_report(run_maintenance(conn)))
+        elif args.command == "recurring":
+            if args.delete is not None:
+                try:
+                    batch = delete_recurring_transaction(conn, args.delete)
+                except ValueError as e:
+                    print(e, file=sys.stderr)
+                    conn.close()
+                    sys.exit(1)
+                print(f"Deleted recurring transaction {args.delete}, to restore it run "
+                      f"'backend.py undo --batch {batch}'")
+            for (recurring_id, value, currency, desc, categ, _, period, every,
+                 start_date, end_date, through) in select_recurring_transactions(conn):
+                print(f"{recurring_id}: {value}{currency} {desc} ({categ}), {period} "
+                      f"every {every}, from {start_date} to {end_date or 'no end'}, "
+                      f"created up to {through or 'none'}")
+        elif args.command == "budget":
+            if args.set is not None:
+                categ, limit = args.set
+                with conn:
+                    set_budget(conn, categ, None if limit.lower() == "none" else float(limit))
+            spend = get_category_spend(conn, args.month)
+            for categ, limit in sorted(select_budgets(conn).items()):
+                spent = spend.get(categ, 0)
+                print(f"{categ}: spent {spent:.2f}£ of {limit:.2f}£ in {args.month}"
+                      + (" - OVER BUDGET" if spent > limit else ""))
+        conn.close()
 
 if __name__ == '__main__':
     main()
@@ -5,19 +5,49 @@ commands is in 'backend' module. The idea of the program is to be able
 to visually interact with a database containing records of monetary transactions.
 Program allows to browse, filter, delete, enter records to the database.
 
-Module contains 2 classes - BudgetTracker and EntryFrame(tk.Toplevel),
-and 1 exception - EmptyDescriptionError(Exception). 
+Module contains 4 classes - BudgetTracker, EntryFrame(tk.Toplevel),
+StatisticsFrame(tk.Toplevel) and BudgetFrame(tk.Toplevel), and 1 exception -
+EmptyDescriptionError(Exception). 
 
 """
 
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
+from tkinter import simpledialog
+from tkinter import filedialog
 import datetime
 from tkcalendar import DateEntry
 import matplotlib.pyplot as plt
+import os
+import queue
 import sqlite3
+import sys
+import threading
 import backend
+import export
+import spending_stats
+
+# delays in milliseconds between background purges of deleted entries
+PURGE_INTERVAL = 10*60*1000
+PURGE_BATCH_DELAY = 1000
+PURGE_BATCH_SIZE = 500
+# delay in milliseconds after the last key press before filters are applied
+FILTER_DELAY = 300
+# delay in milliseconds between checks of progress of backups and exports
+PROGRESS_INTERVAL = 100
+# account selector option showing all accounts together
+ALL_ACCOUNTS = "All accounts"
+# repeat option of entries that do not repeat
+NO_REPEAT = "never"
+CATEGORIES = ['Groceries', 'Shopping', 'Entertainment', 'Restaurants/Bars',
+              'Subscriptions', 'Rent', 'Sports', 'Transport',
+              'Debt', 'Salary', 'Cash withdrawal', 'Other']
+# number of entries shown at first and added by "Load more"
+PAGE_SIZE = 200
+# headings of table columns and the column of 'transactions' each is sorted by
+TABLE_COLUMNS = (("Date", "date"), ("Value", "value"), ("Description", "desc"),
+                 ("Category", "categ"), ("Account", None))
 
 class EntryFrame(tk.Toplevel):
     """Class that handles the frame to enter data.
@@ -31,6 +61,9 @@ class EntryFrame(tk.Toplevel):
         status_message (tkinter.StringVar): holds information text to 
             be outputted
         var_category (tkinter.StringVar): holds selected category
+        var_account (tkinter.StringVar): holds name of selected account
+        var_repeat (tkinter.StringVar): holds period the entry repeats every
+            or NO_REPEAT
     """
     
     def __init__(self, main_window):
@@ -80,20 +113,38 @@ class EntryFrame(tk.Toplevel):
         
         self.var_category = tk.StringVar()
 
-        categories = ['Groceries', 'Shopping', 'Entertainment', 'Restaurants/Bars',
-                      'Subscriptions', 'Rent', 'Sports', 'Transport',
-                      'Debt', 'Salary', 'Cash withdrawal', 'Other']
         ttk.OptionMenu(self,
                        self.var_category,
                        'Groceries',
-                       *categories).grid(row=1, column=4)
+                       *CATEGORIES).grid(row=1, column=4)
 
-        ttk.Button(self, text="Enter", command=self.on_enter).grid(row=1, column=5)
+        ttk.Label(self, text="Account").grid(row=0, column=5)
 
-        ttk.Button(self, text="Close", command=self.on_close).grid(row=1, column=6)
+        self.var_account = tk.StringVar()
+
+        accounts = list(self.main_window.accounts.values())
+        selected_account = self.main_window.var_account.get()
+        ttk.OptionMenu(self,
+                       self.var_account,
+                       selected_account if selected_account in accounts else accounts[0],
+                       *accounts).grid(row=1, column=5)
+
+        ttk.Label(self, text="Repeat").grid(row=0, column=6)
+
+        self.var_repeat = tk.StringVar()
+
+        ttk.OptionMenu(self,
+                       self.var_repeat,
+                       NO_REPEAT,
+                       NO_REPEAT,
+                       *backend.RECURRING_PERIODS).grid(row=1, column=6)
+
+        ttk.Button(self, text="Enter", command=self.on_enter).grid(row=1, column=7)
+
+        ttk.Button(self, text="Close", command=self.on_close).grid(row=1, column=8)
         
         ttk.Label(self, textvariable=self.status_message).grid(row=2,
-                                                               columnspan=7,
+                                                               columnspan=9,
                                                                sticky="w")
 
         self.focus_force()
@@ -152,19 +203,25 @@ class EntryFrame(tk.Toplevel):
 
         else:
             conn = backend.create_connection(self.database)
+            account_id = self.main_window.get_account_id(self.var_account.get())
 
             if conn is None:
                 self.status_message.set("Error! cannot create the database connection.")
             with conn:
                 try:
-                    backend.create_transaction(conn, entry)
+                    self.create_entry(conn, entry, account_id)
                 except sqlite3.OperationalError as e:
                     if str(e) == "no such table: transactions":
                         backend.create_transactions_table(conn)
-                        backend.create_transaction(conn, entry)
+                        self.create_entry(conn, entry, account_id)
                         self.status_message.set("Created a new 'transactions' table\n")
                     else:
-                        raise
+                        self.status_message.set(self.status_message.get()
+                                                + f"{now} Failed to insert data: {e}\n")
+                        return
+                month = f"{entry[0]}"[:7]
+                budget_usage = backend.get_budget_usage(conn, entry[4], month)
+            self.main_window.cached_query = None
             entry_string = [str(item) for item in entry]
 
             if len(self.status_message.get().split("\n")) > 10: #number of lines more than 10 
@@ -179,6 +236,29 @@ class EntryFrame(tk.Toplevel):
                     + f"Succesfully inserted into database: {entry_string}\n")
             self.widgets["entry_value"].delete(0, "end")
             self.widgets["entry_description"].delete(0, "end")
+            if budget_usage is not None and budget_usage[0] > budget_usage[1]:
+                messagebox.showwarning(
+                    "Over budget",
+                    f"Expenses of '{entry[4]}' in {month} are {budget_usage[0]:.2f}£, "
+                    f"over the monthly limit of {budget_usage[1]:.2f}£",
+                    parent=self)
+
+    def create_entry(self, conn, entry, account_id):
+        """Enters entry to database, as a recurring transaction starting at
+        its date if a repeat period is selected. Occurrences up to today are
+        created at once, later ones when they are shown.
+
+        Parameters:
+            conn (Connection): Connection object
+            entry (tuple): date, value, currency, description and category
+            account_id (int): id of account the entry belongs to
+        """
+        if self.var_repeat.get() == NO_REPEAT:
+            backend.create_transaction(conn, entry, account_id=account_id)
+        else:
+            backend.create_recurring_transaction(conn, entry, self.var_repeat.get(),
+                                                 account_id=account_id)
+            backend.materialize_recurring_transactions(conn, datetime.date.today())
 
     def on_close(self):
         """Closes the entry window"""
@@ -186,6 +266,208 @@ class EntryFrame(tk.Toplevel):
         self.destroy()
 
 
+class StatisticsFrame(tk.Toplevel):
+    """Class that handles the frame showing spending statistics.
+
+    Attributes:
+        main_window (BudgetTracker): instance of BudgetTracker class.
+            used to manage the main window of the application
+        statistics (spending_stats.SpendingStatistics): statistics to be shown
+    """
+
+    def __init__(self, main_window, statistics, title):
+        """
+        Parameters:
+            main_window (BudgetTracker): instance of BudgetTracker class.
+                used to manage the main window of the application
+            statistics (spending_stats.SpendingStatistics): statistics to be shown
+            title (string): title of the window
+        """
+        self.main_window = main_window
+        self.statistics = statistics
+        tk.Toplevel.__init__(self)
+        self.title(title)
+        self.configure(background="white")
+
+        ttk.Style().configure("Bold.TLabel", font=("Arial", "10", "bold"))
+        headings = ["Category", "Entries", "Total", "Median size", "90% size",
+                    "Trend per month"]
+        for column, heading in enumerate(headings):
+            ttk.Label(self, text=heading, style="Bold.TLabel",
+                      padding=(6, 0)).grid(row=0, column=column, sticky="w")
+
+        summary = statistics.category_summary()
+        for i, (categ, category_statistics) in enumerate(sorted(summary.items())):
+            cells = [categ,
+                     f"{category_statistics['Entries']}",
+                     f"{category_statistics['Total']:.2f}£",
+                     f"{category_statistics['Median']:.2f}£",
+                     f"{category_statistics['P90']:.2f}£",
+                     f"{category_statistics['Trend']:+.2f}£"
+                     if category_statistics["Trend"] is not None else "-"]
+            for column, text in enumerate(cells):
+                ttk.Label(self, text=text, relief="groove",
+                          padding=(6, 0)).grid(row=1+i, column=column, sticky="nesw")
+
+        if statistics.rolling_average:
+            date, average = statistics.rolling_average[-1]
+            highest_date, highest = max(statistics.rolling_average, key=lambda x: x[1])
+            ttk.Label(
+                self,
+                text=f"{spending_stats.ROLLING_WINDOW}-day average of daily expenses: "
+                     f"{average:.2f}£ on {date}, highest {highest:.2f}£ "
+                     f"on {highest_date}").grid(row=1+len(summary), columnspan=6,
+                                                sticky="w")
+
+        ttk.Button(self, text="Close", command=self.destroy).grid(
+            row=2+len(summary), column=5, sticky="e")
+
+
+class BudgetFrame(tk.Toplevel):
+    """Class that handles the frame to set monthly limits of expenses by
+    category and compare them with expenses of a month.
+
+    Attributes:
+        database (string): path to the SQLite database file
+        main_window (BudgetTracker): instance of BudgetTracker class.
+            used to manage the main window of the application
+        widgets (dict): stores all the tkinter widgets that need to accessed from
+            other methods in class
+        var_month (tkinter.StringVar): holds month shown, in YYYY-MM format
+        budgets (dict): monthly limits by category
+        spend (dict): expenses of the month shown by category
+    """
+
+    def __init__(self, main_window):
+        """
+        Parameters:
+            main_window (BudgetTracker): instance of BudgetTracker class.
+                used to manage the main window of the application
+        """
+        self.database = main_window.database
+        self.main_window = main_window
+        tk.Toplevel.__init__(self)
+        self.title("Budgets")
+        self.configure(background="white")
+        self.widgets = {}
+        self.budgets = {}
+        self.spend = {}
+
+        ttk.Label(self, text="Month").grid(row=0, column=0, sticky="w")
+        self.var_month = tk.StringVar(value=datetime.date.today().isoformat()[:7])
+        ttk.Entry(self, textvariable=self.var_month, width=8).grid(row=0, column=1,
+                                                                  sticky="w")
+        ttk.Button(self, text="Show", command=self.on_show_month).grid(row=0, column=2)
+
+        ttk.Style().configure("Bold.TLabel", font=("Arial", "10", "bold"))
+        for column, heading in enumerate(["Category", "Monthly limit", "Spent", "Left"]):
+            ttk.Label(self, text=heading, style="Bold.TLabel",
+                      padding=(6, 0)).grid(row=1, column=column, sticky="w")
+
+        self.widgets["limit_entries"] = {}
+        self.widgets["spent_labels"] = {}
+        self.widgets["left_labels"] = {}
+        for i, categ in enumerate(CATEGORIES):
+            ttk.Label(self, text=categ, relief="groove",
+                      padding=(6, 0)).grid(row=2+i, column=0, sticky="nesw")
+            self.widgets["limit_entries"][categ] = ttk.Entry(self, width=10)
+            self.widgets["limit_entries"][categ].grid(row=2+i, column=1, sticky="nesw")
+            for column, labels in ((2, "spent_labels"), (3, "left_labels")):
+                self.widgets[labels][categ] = ttk.Label(self, relief="groove",
+                                                        padding=(6, 0))
+                self.widgets[labels][categ].grid(row=2+i, column=column, sticky="nesw")
+
+        self.widgets["status_msg"] = ttk.Label(self, foreground="red")
+        self.widgets["status_msg"].grid(row=2+len(CATEGORIES), column=0, columnspan=4,
+                                        sticky="w")
+        button_row = 3 + len(CATEGORIES)
+        ttk.Button(self, text="Save limits", command=self.on_save).grid(
+            row=button_row, column=0, sticky="w")
+        ttk.Button(self, text="Plot budget vs actual", command=self.on_plot).grid(
+            row=button_row, column=1, columnspan=2)
+        ttk.Button(self, text="Close", command=self.destroy).grid(
+            row=button_row, column=3, sticky="e")
+
+        self.on_show_month()
+        for categ, entry in self.widgets["limit_entries"].items():
+            if categ in self.budgets:
+                entry.insert(0, f"{self.budgets[categ]:.2f}")
+
+    def on_show_month(self):
+        """Shows expenses of the month entered, read from spend counters"""
+        month = self.var_month.get().strip()
+        try:
+            datetime.datetime.strptime(month, "%Y-%m")
+        except ValueError:
+            self.widgets["status_msg"].configure(text="Error. Month has to be YYYY-MM")
+            return
+        conn = backend.create_connection(self.database)
+        if conn is None:
+            self.widgets["status_msg"].configure(
+                text="Error. Cannot create database connection")
+            return
+        with conn:
+            self.budgets = backend.select_budgets(conn)
+            self.spend = backend.get_category_spend(conn, month)
+        conn.close()
+        self.widgets["status_msg"].configure(text="")
+        for categ in CATEGORIES:
+            spent = self.spend.get(categ, 0)
+            self.widgets["spent_labels"][categ].configure(text=f"{spent:.2f}£")
+            if categ in self.budgets:
+                left = self.budgets[categ] - spent
+                self.widgets["left_labels"][categ].configure(
+                    text=f"{left:.2f}£", foreground="red" if left < 0 else "black")
+            else:
+                self.widgets["left_labels"][categ].configure(text="-", foreground="black")
+
+    def on_save(self):
+        """Saves limits entered, categories with no limit have no budget"""
+        limits = {}
+        for categ, entry in self.widgets["limit_entries"].items():
+            try:
+                limits[categ] = float(entry.get()) if entry.get().strip() else None
+            except ValueError:
+                self.widgets["status_msg"].configure(
+                    text=f"Error. Invalid limit of '{categ}'")
+                return
+        conn = backend.create_connection(self.database)
+        if conn is None:
+            self.widgets["status_msg"].configure(
+                text="Error. Cannot create database connection")
+            return
+        with conn:
+            for categ, limit in limits.items():
+                backend.set_budget(conn, categ, limit)
+        conn.close()
+        self.on_show_month()
+
+    def on_plot(self):
+        """Plots bar chart of limit and expenses of each budgeted category in
+        the month shown"""
+        categs = [categ for categ in CATEGORIES if categ in self.budgets]
+        if not categs:
+            self.widgets["status_msg"].configure(text="No budgets to plot")
+            return
+        positions = range(len(categs))
+        fig = plt.figure(figsize=(max(6, len(categs)*1.2), 5))
+        axes = fig.gca()
+        axes.bar([x - 0.2 for x in positions], [self.budgets[categ] for categ in categs],
+                 width=0.4, color="silver", label="Limit")
+        spent = [self.spend.get(categ, 0) for categ in categs]
+        axes.bar([x + 0.2 for x in positions], spent, width=0.4, label="Spent",
+                 color=["lightcoral" if value > self.budgets[categ] else "#87e37d"
+                        for categ, value in zip(categs, spent)])
+        axes.set_xticks(list(positions))
+        axes.set_xticklabels(categs)
+        axes.set_ylabel("Amount (£)")
+        axes.set_title(f"Budget vs actual in {self.var_month.get().strip()}")
+        axes.legend(loc="best")
+        axes.grid()
+        plt.tight_layout()
+        plt.show()
+
+
 class EmptyDescriptionError(Exception):
     """Exception thrown to stop entries without desciptions to be inserted"""
     pass
@@ -206,7 +488,25 @@ class BudgetTracker:
             by value
         search_description_state (tkinter.IntVar): holds state whether to search in
             description
-        data_entry_ids (list): list containing ids of returned data entries
+        data_entry_ids (list): list containing (source, id) of returned data
+            entries, see backend.Transaction
+        accounts (dict): names of accounts by their id
+        var_account (tkinter.StringVar): holds name of account to be shown or
+            ALL_ACCOUNTS
+        last_query (tuple): dates, filter arguments and account id's of
+            the entries shown in the table
+        cached_query (tuple): dates, filter arguments and account id's of
+            the entries last selected from the database
+        cached_table_data (TransactionResultSet): entries last selected
+            from the database, only kept when all entries of the query fit
+            on the first page
+        sort_column (string): column of 'transactions' the table is sorted by
+        sort_descending (bool): specifies whether the table is sorted in
+            descending order
+        sorted_table_data (TransactionResultSet): all entries of the table in
+            order shown if known, otherwise further pages are selected from
+            the database
+        pending_filter (string): id of scheduled on_show_entries call
         expenses_by_category (dict): stores total balance for each category found.
             Used to plot bar chart.
     """
@@ -222,10 +522,36 @@ class BudgetTracker:
         # hide window in background during drawing
         self.root.withdraw()
 
+        # create 'transactions' table or upgrade one made by an older version,
+        # then create entries of recurring transactions due since last run
+        conn = backend.create_connection(self.database)
+        if conn is not None:
+            with conn:
+                backend.create_transactions_table(conn)
+                backend.materialize_recurring_transactions(conn, datetime.date.today())
+            conn.close()
+
         self.is_entry_window_open = False
 
         self.widgets = {}
 
+        menu_bar = tk.Menu(self.root)
+        self.widgets["database_menu"] = tk.Menu(menu_bar, tearoff=0)
+        self.widgets["database_menu"].add_command(label="Run maintenance",
+                                                  command=self.on_maintenance)
+        self.widgets["database_menu"].add_command(label="Add account...",
+                                                  command=self.on_add_account)
+        self.widgets["database_menu"].add_command(label="Back up database...",
+                                                  command=self.on_backup)
+        self.widgets["database_menu"].add_command(label="Export shown transactions...",
+                                                  command=self.on_export)
+        menu_bar.add_cascade(label="Database", menu=self.widgets["database_menu"])
+        view_menu = tk.Menu(menu_bar, tearoff=0)
+        view_menu.add_command(label="Statistics", command=self.on_show_statistics)
+        view_menu.add_command(label="Budgets", command=lambda: BudgetFrame(self))
+        menu_bar.add_cascade(label="View", menu=view_menu)
+        self.root.config(menu=menu_bar)
+
         gui_style = ttk.Style()
         gui_style.configure('TFrame', background='white')
         gui_style.configure('TLabel', background='white')
@@ -271,9 +597,26 @@ class BudgetTracker:
             command=self.on_plot_bar_charts)
         plot_bar_chart_btn.grid(row=5, column=0, sticky="nesw")
 
+        self.widgets["undo_btn"] = ttk.Button(
+            menu_frame,
+            text="Undo delete",
+            command=self.on_undo_delete)
+        self.widgets["undo_btn"].grid(row=5, column=1, sticky="nesw")
+        self.widgets["undo_btn"].state(["disabled"])
+
+
+        ttk.Label(menu_frame, text="Account: ").grid(row=6, column=0)
+
+        self.accounts = {}
+        self.var_account = tk.StringVar()
+        self.widgets["account_menu"] = ttk.OptionMenu(menu_frame, self.var_account,
+                                                       ALL_ACCOUNTS,
+                                                       command=self.on_filter_changed)
+        self.widgets["account_menu"].grid(row=6, column=1, sticky="nesw")
+        self.load_accounts()
 
         self.widgets["status_msg"] = ttk.Label(menu_frame, foreground="red")
-        self.widgets["status_msg"].grid(row=6, column=0, columnspan=4, sticky="w")
+        self.widgets["status_msg"].grid(row=7, column=0, columnspan=4, sticky="w")
 
         self.apply_filters_state = tk.IntVar()
         apply_filter_cbtn = ttk.Checkbutton(menu_frame,
@@ -287,9 +630,7 @@ class BudgetTracker:
             text="Category:", state="disabled")
         self.widgets["category_label"].grid(row=1, column=2, columnspan=2)
 
-        categories = ['Groceries', 'Shopping', 'Entertainment', 'Restaurants/Bars',
-                      'Subscriptions', 'Rent', 'Sports', 'Transport',
-                      'Debt', 'Salary', 'Cash withdrawal', 'Other', 'All']
+        categories = CATEGORIES + ['All']
         self.var_category = tk.StringVar()
         self.widgets["category_menu"] = ttk.OptionMenu(menu_frame,
                                                         self.var_category,
@@ -354,9 +695,23 @@ class BudgetTracker:
         self.widgets["table_canvas"] = None
         self.widgets["scroll_bar"] = None
         self.widgets["data_entry_cbuttons"] = []
+        self.widgets["data_entry_rows"] = []
+        self.widgets["balance_label"] = None
         self.data_entry_ids = []
+        self.last_query = None
+        self.cached_query = None
+        self.cached_table_data = backend.TransactionResultSet()
+        self.sort_column = "date"
+        self.sort_descending = False
+        self.sorted_table_data = None
+        self.pending_filter = None
         self.expenses_by_category = {}
 
+        for entry in ("min_value_entry", "max_value_entry", "search_description_entry"):
+            self.widgets[entry].bind("<KeyRelease>", self.on_filter_changed)
+
+        self.root.after(PURGE_INTERVAL, self.on_purge_deleted)
+
         self.root.update_idletasks()
         self.root.deiconify()
         screen_width = self.root.winfo_screenwidth()
@@ -371,24 +726,241 @@ class BudgetTracker:
         self.root.geometry(f"+{x_coordinate}+{y_coordinate}")
 
     def on_delete(self):
-        """Deletes selected entries of the table."""
+        """Deletes selected entries of the table and removes them from the table."""
         selected_rows = []
-        for cbutton in self.widgets["data_entry_cbuttons"]:
+        for i, cbutton in enumerate(self.widgets["data_entry_cbuttons"]):
             if cbutton.instate(["selected"]):
-                selected_rows.append(cbutton.grid_info()["row"]-1)
+                selected_rows.append(i)
         if selected_rows:
             if messagebox.askokcancel("Delete",
                                       "Are you sure you want to delete "
                                       f"{len(selected_rows)} selected entries?"):
-                ids_to_delete = []
+                entries_to_delete = []
                 for selected_row in selected_rows:
-                    ids_to_delete.append(self.data_entry_ids[selected_row])
+                    entries_to_delete.append(self.data_entry_ids[selected_row])
                 conn = backend.create_connection(self.database)
-                with conn:
-                    backend.delete_transactions(conn, ids_to_delete)
+                self.cached_query = None
+                self.sorted_table_data = None
+                try:
+                    with conn:
+                        backend.delete_transactions(conn, entries_to_delete)
+                        balance = backend.get_balance(conn,
+                                                      *self.last_query[:2],
+                                                      *self.last_query[2],
+                                                      accounts=self.last_query[3])
+                except sqlite3.Error as e:
+                    self.widgets["status_msg"].configure(
+                        text=f"Error. Cannot delete entries: {e}")
+                    return
+                finally:
+                    conn.close()
+
+                for selected_row in reversed(selected_rows):
+                    for widget in self.widgets["data_entry_rows"].pop(selected_row):
+                        widget.destroy()
+                    self.widgets["data_entry_cbuttons"].pop(selected_row)
+                    self.data_entry_ids.pop(selected_row)
+                self.widgets["balance_label"].configure(text=balance_text(balance))
+                self.widgets["undo_btn"].state(["!disabled"])
+                self.is_any_row_checked()
+
+    def on_undo_delete(self):
+        """Restores entries deleted last."""
+        conn = backend.create_connection(self.database)
+        try:
+            with conn:
+                backend.undo_delete(conn)
+        except sqlite3.Error as e:
+            self.widgets["status_msg"].configure(text=f"Error. Cannot restore entries: {e}")
+            return
+        finally:
+            conn.close()
+        self.widgets["undo_btn"].state(["disabled"])
+        self.cached_query = None
+        self.on_show_entries()
+
+    def on_purge_deleted(self):
+        """Permanently removes a batch of old deleted entries in a separate
+        thread. Runs again soon while there are more entries to remove."""
+        def purge(report):
+            conn = backend.create_connection(self.database)
+            if conn is None:
+                return 0
+            try:
+                return backend.purge_deleted_transactions(conn,
+                                                          batch_size=PURGE_BATCH_SIZE)
+            except sqlite3.Error as e:
+                print(e, file=sys.stderr)
+                return 0
+            finally:
+                conn.close()
+
+        def schedule(purged):
+            delay = PURGE_BATCH_DELAY if purged == PURGE_BATCH_SIZE else PURGE_INTERVAL
+            self.root.after(delay, self.on_purge_deleted)
+
+        self.run_in_background("Purge deleted entries", purge, done=schedule)
+
+    def on_maintenance(self):
+        """Runs database maintenance in a separate thread and shows its
+        report when it ends."""
+        def maintain(report):
+            conn = backend.create_connection(self.database)
+            if conn is None:
+                raise sqlite3.Error("Cannot create database connection")
+            report("Running database maintenance...")
+            try:
+                return backend.format_maintenance_report(backend.run_maintenance(conn))
+            finally:
+                conn.close()
+
+        self.run_in_background("Database maintenance", maintain)
+
+    def run_in_background(self, title, task, done=None):
+        """Runs task in a separate thread so that the window stays responsive,
+        showing progress it reports in the status message. Task has to open
+        its own database connection.
+
+        Parameters:
+            title (string): title of the message box shown when task ends
+            task (function): called with a function to report progress text
+                to, returns text shown when task ends
+            done (function): if given, called with what task returned, or
+                with the error text if it failed, instead of showing it
+        """
+        messages = queue.Queue()
+
+        def run_task():
+            try:
+                messages.put((True, task(lambda text: messages.put((False, text)))))
+            except (OSError, ValueError, sqlite3.Error) as e:
+                messages.put((True, f"Failed: {e}"))
+
+        def show_progress():
+            try:
+                while True:
+                    finished, text = messages.get_nowait()
+                    if finished and done is not None:
+                        done(text)
+                        return
+                    if finished:
+                        self.widgets["status_msg"].configure(text="")
+                        messagebox.showinfo(title, text)
+                        return
+                    self.widgets["status_msg"].configure(text=text)
+            except queue.Empty:
+                self.root.after(PROGRESS_INTERVAL, show_progress)
+
+        threading.Thread(target=run_task, daemon=True).start()
+        show_progress()
+
+    def on_backup(self):
+        """Saves a consistent snapshot of the database to a file chosen,
+        without blocking the window or entries made meanwhile."""
+        target = filedialog.asksaveasfilename(
+            title="Back up database", defaultextension=".db",
+            initialfile=f"transaction_database_{datetime.date.today()}.db",
+            filetypes=[("SQLite database", "*.db")])
+        if not target:
+            return
+        if os.path.abspath(target) == os.path.abspath(self.database):
+            self.widgets["status_msg"].configure(
+                text="Error. Cannot back up database to itself")
+            return
+
+        def backup(report):
+            copied, seconds = export.backup_database(
+                self.database, target,
+                progress=lambda done, total: report(f"Backing up: {done}/{total} pages"))
+            return (f"Copied {copied/2**20:.1f} MiB to {target} in {seconds:.2f} s "
+                    f"({copied/2**20/max(seconds, 1e-9):.1f} MiB/s)")
+
+        self.run_in_background("Back up database", backup)
+
+    def on_export(self):
+        """Writes entries matching the conditions of the table shown to a
+        gzip-compressed CSV or JSON Lines file chosen."""
+        if self.last_query is None:
+            self.widgets["status_msg"].configure(text="No transactions shown to export")
+            return
+        path = filedialog.asksaveasfilename(
+            title="Export shown transactions", defaultextension=".csv.gz",
+            filetypes=[("Compressed CSV", "*.csv.gz"),
+                       ("Compressed JSON Lines", "*.jsonl.gz")])
+        if not path:
+            return
+        query = self.last_query
+
+        def export_shown(report):
+            conn = backend.create_connection(self.database)
+            if conn is None:
+                raise sqlite3.Error("Cannot create database connection")
+            with conn:
+                written, seconds = export.export_transactions(
+                    conn, path, *query[:2], *query[2], accounts=query[3],
+                    progress=lambda written: report(f"Exporting: {written} entries"))
+            conn.close()
+            return (f"Exported {written} entries to {path} in {seconds:.2f} s "
+                    f"({written/max(seconds, 1e-9):.0f} entries/s)")
+
+        self.run_in_background("Export shown transactions", export_shown)
+
+    def load_accounts(self):
+        """Reads accounts from the database and fills the account selector."""
+        conn = backend.create_connection(self.database)
+        if conn is not None:
+            with conn:
+                self.accounts = dict(backend.select_accounts(conn))
+            conn.close()
+        names = [ALL_ACCOUNTS] + list(self.accounts.values())
+        if self.var_account.get() not in names:
+            self.var_account.set(ALL_ACCOUNTS)
+        self.widgets["account_menu"].set_menu(self.var_account.get(), *names)
+
+    def on_add_account(self):
+        """Asks for a name and adds a new account."""
+        name = simpledialog.askstring("Add account", "Account name:", parent=self.root)
+        if not name:
+            return
+        conn = backend.create_connection(self.database)
+        try:
+            with conn:
+                backend.create_account(conn, name)
+        except sqlite3.IntegrityError:
+            self.widgets["status_msg"].configure(
+                text=f"Account '{name}' already exists")
+        finally:
+            conn.close()
+        self.load_accounts()
+
+    def get_account_id(self, name):
+        """Returns id of account given its name"""
+        for account_id, account_name in self.accounts.items():
+            if account_name == name:
+                return account_id
+        return backend.DEFAULT_ACCOUNT_ID
+
+    def get_accounts(self):
+        """Returns id's of accounts to be shown, or None to show all accounts
+        together."""
+        if self.var_account.get() == ALL_ACCOUNTS:
+            return None
+        return [self.get_account_id(self.var_account.get())]
+
+    def get_filters(self):
+        """Returns filter arguments for 'backend' queries according to
+        the filters selected. Raises ValueError if min or max value is invalid."""
+        if not self.apply_filters_state.get():
+            return ()
+        filters = ()
+        if self.in_value_range_state.get():
+            filters += (float(self.widgets["min_value_entry"].get()),
+                        float(self.widgets["max_value_entry"].get()))
+        filters += (self.var_category.get(),)
+        if self.search_description_state.get():
+            filters += (self.widgets["search_description_entry"].get(),)
+        return filters
 
-                self.on_show_entries()
-        
     def on_change_apply_filters_state(self):
         """Changes state of filter widgets."""
         if self.apply_filters_state.get():
@@ -443,37 +1015,12 @@ class BudgetTracker:
                 text="Error. Cannot create database connection")
         with conn:
             try:
-                if self.apply_filters_state.get():
-                    if self.in_value_range_state.get():
-                        if self.search_description_state.get():
-                            self.expenses_by_category = backend.get_expenses_by_category()
-                        else:
-                            self.expenses_by_category = backend.get_expenses_by_category(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                float(self.widgets["min_value_entry"].get()),
-                                float(self.widgets["max_value_entry"].get()),
-                                self.var_category.get())
-                    else:
-                        if self.search_description_state.get():
-                            self.expenses_by_category = backend.get_expenses_by_category(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                self.var_category.get(),
-                                self.widgets["search_description_entry"].get())
-                        else:
-                            self.expenses_by_category = backend.get_expenses_by_category(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                self.var_category.get())
-                else:
-                    self.expenses_by_category = backend.get_expenses_by_category(
-                        conn,
-                        self.widgets["date_from"].get(),
-                        self.widgets["date_to"].get())
+                self.expenses_by_category = backend.get_expenses_by_category(
+                    conn,
+                    self.widgets["date_from"].get(),
+                    self.widgets["date_to"].get(),
+                    *self.get_filters(),
+                    accounts=self.get_accounts())
 
             except ValueError:
                 self.widgets["status_msg"].configure(
@@ -540,119 +1087,188 @@ class BudgetTracker:
             self.widgets["status_msg"].configure(
                 text="Need data from at least 2 categories")
 
-    def on_show_entries(self):
-        """Displays the data table according to conditions given."""
+    def on_filter_changed(self, event=None):
+        """Shows entries matching the filters once user stops typing."""
+        if self.pending_filter:
+            self.root.after_cancel(self.pending_filter)
+        self.pending_filter = self.root.after(FILTER_DELAY, self.on_show_entries, True)
+
+    def on_show_statistics(self):
+        """Opens a window with spending statistics of entries matching the
+        conditions given."""
+        try:
+            filters = self.get_filters()
+        except ValueError:
+            self.widgets["status_msg"].configure(
+                text="Error. Invalid min or max value")
+            return
         conn = backend.create_connection(self.database)
         if conn is None:
             self.widgets["status_msg"].configure(
                 text="Error. Cannot create database connection")
+            return
         with conn:
-            try:
-                if self.apply_filters_state.get():
-                    if self.in_value_range_state.get():
-                        if self.search_description_state.get():
-                            table_data = backend.select_transactions(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                float(self.widgets["min_value_entry"].get()),
-                                float(self.widgets["max_value_entry"].get()),
-                                self.var_category.get(),
-                                self.widgets["search_description_entry"].get())
-                            balance = backend.get_balance(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                float(self.widgets["min_value_entry"].get()),
-                                float(self.widgets["max_value_entry"].get()),
-                                self.var_category.get(),
-                                self.widgets["search_description_entry"].get())
-                            self.expenses_by_category = backend.get_expenses_by_category()
-                        else:
-                            table_data = backend.select_transactions(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                float(self.widgets["min_value_entry"].get()),
-                                float(self.widgets["max_value_entry"].get()),
-                                self.var_category.get())
-                            balance = backend.get_balance(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                float(self.widgets["min_value_entry"].get()),
-                                float(self.widgets["max_value_entry"].get()),
-                                self.var_category.get())
-                            self.expenses_by_category = backend.get_expenses_by_category(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                float(self.widgets["min_value_entry"].get()),
-                                float(self.widgets["max_value_entry"].get()),
-                                self.var_category.get())
-                    else:
-                        if self.search_description_state.get():
-                            table_data = backend.select_transactions(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                self.var_category.get(),
-                                self.widgets["search_description_entry"].get())
-                            balance = backend.get_balance(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                self.var_category.get(),
-                                self.widgets["search_description_entry"].get())
-                            self.expenses_by_category = backend.get_expenses_by_category(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                self.var_category.get(),
-                                self.widgets["search_description_entry"].get())
-                        else:
-                            table_data = backend.select_transactions(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                self.var_category.get())
-                            balance = backend.get_balance(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                self.var_category.get())
-                            self.expenses_by_category = backend.get_expenses_by_category(
-                                conn,
-                                self.widgets["date_from"].get(),
-                                self.widgets["date_to"].get(),
-                                self.var_category.get())
-                else:
+            statistics = spending_stats.stream_statistics(
+                conn,
+                self.widgets["date_from"].get(),
+                self.widgets["date_to"].get(),
+                *filters,
+                accounts=self.get_accounts())
+        conn.close()
+        if not statistics.monthly:
+            self.widgets["status_msg"].configure(text="No data to show")
+            return
+        self.widgets["status_msg"].configure(text="")
+        StatisticsFrame(self, statistics,
+                        f"Statistics from {self.widgets['date_from'].get()} "
+                        f"to {self.widgets['date_to'].get()}")
+
+    def on_sort(self, column):
+        """Sorts the table by column given, reversing the order if the table
+        is already sorted by it.
+
+        Parameters:
+            column (string): column of 'transactions' to sort by
+        """
+        if column == self.sort_column:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_column = column
+            self.sort_descending = False
+        self.on_show_entries()
+
+    def select_page(self, offset):
+        """Returns PAGE_SIZE + 1 entries of the table starting at offset, in
+        the order table is sorted by. The extra entry tells if there are more
+        entries to show.
+
+        Parameters:
+            offset (int): number of entries before the page
+        Returns:
+            TransactionResultSet: entries of the page
+        """
+        if self.sorted_table_data is not None:
+            return self.sorted_table_data[offset:offset + PAGE_SIZE + 1]
+        conn = backend.create_connection(self.database)
+        with conn:
+            page = backend.select_transactions(conn, *self.last_query[:2],
+                                               *self.last_query[2],
+                                               accounts=self.last_query[3],
+                                               order_by=self.sort_column,
+                                               descending=self.sort_descending,
+                                               limit=PAGE_SIZE + 1, offset=offset)
+        conn.close()
+        return page
+
+    def on_load_more(self):
+        """Adds next page of entries to the table."""
+        page = self.select_page(len(self.data_entry_ids))
+        self.add_table_rows(page)
+
+    def add_table_rows(self, page):
+        """Adds entries to the bottom of the table, followed by balance and
+        "Load more" button if there are more entries than given.
+
+        Parameters:
+            page (TransactionResultSet): entries returned by select_page
+        """
+        table_frame = self.widgets["table_frame"]
+        first_row = table_frame.grid_size()[1]
+        for i, row in enumerate(page[:PAGE_SIZE]):
+            cbutton = ttk.Checkbutton(table_frame, command=self.is_any_row_checked)
+            cbutton.grid(row=first_row+i, column=0)
+            cbutton.state(["!alternate"])
+            if row.source == backend.RECURRING_SOURCE:
+                # future occurrence, deleted with its recurring transaction
+                cbutton.state(["disabled"])
+            self.widgets["data_entry_cbuttons"].append(cbutton)
+            self.data_entry_ids.append((row.source, row.id))
+
+            row_widgets = [cbutton]
+            for column, text in enumerate((f"{row.date}", f"{row.value}{row.currency}",
+                                           f"{row.desc}", f"{row.categ}",
+                                           f"{self.accounts.get(row.account_id, '')}")):
+                row_widgets.append(ttk.Label(table_frame, text=text, relief="groove",
+                                             padding=(6, 0)))
+                row_widgets[-1].grid(row=first_row+i, column=1+column, sticky="nesw")
+            self.widgets["data_entry_rows"].append(row_widgets)
+        last_row = first_row + min(len(page), PAGE_SIZE)
+        self.widgets["balance_label"].grid(row=last_row, column=0, columnspan=6,
+                                           sticky="w")
+        if len(page) > PAGE_SIZE:
+            self.widgets["load_more_btn"].grid(row=last_row+1, column=0, columnspan=6)
+        else:
+            self.widgets["load_more_btn"].grid_remove()
+
+    def on_show_entries(self, refine=False):
+        """Displays the data table according to conditions given. Only the
+        first page of entries is shown, more are added with "Load more".
+
+        Parameters:
+            refine (bool): If True and the conditions are narrower than the
+                ones of entries shown last, entries are selected from those
+                instead of querying the database, as they are while the user
+                types. Otherwise the database is queried, so that entries
+                written by other programs are shown.
+        """
+        if self.pending_filter:
+            self.root.after_cancel(self.pending_filter)
+            self.pending_filter = None
+        if not refine:
+            self.cached_query = None
+        try:
+            filters = self.get_filters()
+        except ValueError:
+            self.widgets["status_msg"].configure(
+                text="Error. Invalid min or max value")
+            return
+        query = (self.widgets["date_from"].get(), self.widgets["date_to"].get(), filters,
+                 self.get_accounts())
+
+        if self.cached_query and backend.is_narrower_query(self.cached_query, query):
+            self.sorted_table_data = backend.sort_transactions(
+                backend.refine_transactions(self.cached_table_data, *query[:2],
+                                            *filters, accounts=query[3]),
+                self.sort_column, self.sort_descending)
+            table_data = self.sorted_table_data[:PAGE_SIZE + 1]
+            balance = backend.get_balance_of_rows(self.sorted_table_data)
+            self.expenses_by_category = backend.get_expenses_by_category_of_rows(
+                self.sorted_table_data)
+            self.widgets["status_msg"].configure(text="")
+        else:
+            conn = backend.create_connection(self.database)
+            if conn is None:
+                self.widgets["status_msg"].configure(
+                    text="Error. Cannot create database connection")
+            with conn:
+                try:
                     table_data = backend.select_transactions(
-                        conn,
-                        self.widgets["date_from"].get(),
-                        self.widgets["date_to"].get())
-                    balance = backend.get_balance(
-                        conn,
-                        self.widgets["date_from"].get(),
-                        self.widgets["date_to"].get())
+                        conn, *query[:2], *filters, accounts=query[3],
+                        order_by=self.sort_column, descending=self.sort_descending,
+                        limit=PAGE_SIZE + 1)
+                    balance = backend.get_balance(conn, *query[:2], *filters,
+                                                  accounts=query[3])
                     self.expenses_by_category = backend.get_expenses_by_category(
-                        conn,
-                        self.widgets["date_from"].get(),
-                        self.widgets["date_to"].get())
+                        conn, *query[:2], *filters, accounts=query[3])
 
-            except ValueError:
-                self.widgets["status_msg"].configure(
-                    text="Error. Invalid min or max value")
-                return
-            except sqlite3.OperationalError as e :
-                if str(e) == "no such table: transactions":
-                    self.widgets["status_msg"].configure(
-                        text="Database error. Could not find table 'transactions'.")
-                    return
+                except sqlite3.OperationalError as e :
+                    if str(e) == "no such table: transactions":
+                        self.widgets["status_msg"].configure(
+                            text="Database error. Could not find table 'transactions'.")
+                        return
+                    else:
+                        raise
                 else:
-                    raise
+                    self.widgets["status_msg"].configure(text="")
+            if len(table_data) > PAGE_SIZE:
+                # only the first page is known, further pages are queried
+                self.cached_query = None
+                self.sorted_table_data = None
             else:
-                self.widgets["status_msg"].configure(text="")
+                self.cached_query = query
+                self.cached_table_data = table_data
+                self.sorted_table_data = table_data
+        self.last_query = query
         
         if self.widgets["table_canvas"]:
             self.widgets["table_canvas"].destroy()
@@ -682,41 +1298,30 @@ class BudgetTracker:
                     scrollregion=self.widgets["table_canvas"].bbox("all")))
             self.widgets["table_canvas"].bind_all("<MouseWheel>", self.on_mousewheel)
             self.widgets["status_msg"].configure(text="")
-            #define column headings
+            #define column headings, clicking one sorts the table by its column
             ttk.Style().configure("Bold.TLabel", font=("Arial", "10", "bold"))
-            ttk.Label(table_frame, text="Date", style="Bold.TLabel",
-                      padding=(6, 0)).grid(row=0, column=1, sticky="w")
-            ttk.Label(table_frame, text="Value", style="Bold.TLabel",
-                      padding=(6, 0)).grid(row=0, column=2, sticky="w")
-            ttk.Label(table_frame, text="Description", style="Bold.TLabel",
-                      padding=(6, 0)).grid(row=0, column=3, sticky="w")
-            ttk.Label(table_frame, text="Category", style="Bold.TLabel",
-                      padding=(6, 0)).grid(row=0, column=4, sticky="w")
-
+            for column, (heading, sort_column) in enumerate(TABLE_COLUMNS):
+                if sort_column == self.sort_column:
+                    heading += " \u25bc" if self.sort_descending else " \u25b2"
+                label = ttk.Label(table_frame, text=heading, style="Bold.TLabel",
+                                  padding=(6, 0))
+                label.grid(row=0, column=1+column, sticky="w")
+                if sort_column is not None:
+                    label.configure(cursor="hand2")
+                    label.bind("<Button-1>",
+                               lambda event, sort_column=sort_column:
+                               self.on_sort(sort_column))
+
+            self.widgets["table_frame"] = table_frame
             self.widgets["data_entry_cbuttons"] = []
+            self.widgets["data_entry_rows"] = []
             self.data_entry_ids = []
+            self.widgets["balance_label"] = ttk.Label(table_frame,
+                                                      text=balance_text(balance))
+            self.widgets["load_more_btn"] = ttk.Button(table_frame, text="Load more",
+                                                       command=self.on_load_more)
             #fill table with data
-            for i, row in enumerate(table_data):
-                self.widgets["data_entry_cbuttons"].append(ttk.Checkbutton(table_frame,
-                                            command=self.is_any_row_checked))
-                self.widgets["data_entry_cbuttons"][-1].grid(row=1+i, column=0)
-                self.widgets["data_entry_cbuttons"][-1].state(["!alternate"])
-                self.data_entry_ids.append(row[0])
-
-                ttk.Label(table_frame, text=f"{row[1]}", relief="groove",
-                          padding=(6, 0)).grid(row=1+i, column=1, sticky="nesw")
-                ttk.Label(table_frame, text=f"{row[2]}{row[3]}", relief="groove",
-                          padding=(6, 0)).grid(row=1+i, column=2, sticky="nesw")
-                ttk.Label(table_frame, text=f"{row[4]}", relief="groove",
-                          padding=(6, 0)).grid(row=1+i, column=3, sticky="nesw")
-                ttk.Label(table_frame, text=f"{row[5]}", relief="groove",
-                          padding=(6, 0)).grid(row=1+i, column=4, sticky="nesw")
-            ttk.Label(
-                table_frame,
-                text=f"Spent: {balance['Expenses']:.2f}£\n"
-                     f"Received: {balance['Received']:.2f}£\n"
-                     f"Total balance: {balance['Total']:.2f}£").grid(columnspan=5,
-                                                                     sticky="w")
+            self.add_table_rows(table_data)
 
             self.root.grid_rowconfigure(1, weight=1)
             table_frame.update_idletasks()
@@ -746,6 +1351,12 @@ class BudgetTracker:
         self.widgets["delete_btn"].state(["disabled"])
 
 
+def balance_text(balance):
+    """Returns text showing balance returned by backend.get_balance"""
+    return (f"Spent: {balance['Expenses']:.2f}£\n"
+            f"Received: {balance['Received']:.2f}£\n"
+            f"Total balance: {balance['Total']:.2f}£")
+
 def is_numeric(char):
     """Function to validate whether entry is numeric """
     try:
@@ -0,0 +1,238 @@
+"""
+This module imports a directory of statement files into 'transactions'
+table. Files are read and validated in a pool of processes, one file per
+task, and the normalized entries are written by the main process through
+a single connection, committing many files in one transaction. A file with
+an invalid line is skipped as a whole and reported, the rest of the files
+are still imported.
+
+Statement files are CSV files with columns date, value, currency,
+description and category, optionally preceded by a header line, e.g.
+2020-07-02,-12.50,£,Tesco,Groceries
+A first line starting with a date is an entry and has to be valid, any
+other first line is taken for the header.
+
+Module contains functions parse_statement(path), statement_paths(paths) and
+import_statements(conn, paths, account_id, skip_duplicates, workers, progress).
+To import from the command line:
+python bulk_import.py statements/ --account Main
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import os
+import sqlite3
+import sys
+import time
+import backend
+
+# date formats accepted in statement files, first one that matches is used
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%d.%m.%Y")
+
+# currency codes accepted in place of currency symbols
+CURRENCY_CODES = {"GBP": "£", "EUR": "€", "USD": "$"}
+
+# entries written between commits
+COMMIT_ROWS = 50000
+
+def parse_date(text):
+    """Returns date in YYYY-MM-DD format or raises ValueError
+
+    Parameters:
+        text (string): Date in one of DATE_FORMATS
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text.strip(), date_format).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"unknown date '{text}'")
+
+def is_header(row):
+    """Checks if the first line of statement file is a header line, that is
+    its first cell is not a date in one of DATE_FORMATS.
+
+    Parameters:
+        row (list): cells of the line
+    Returns:
+        bool: True if the line is a header line
+    """
+    try:
+        parse_date(row[0])
+    except ValueError:
+        return True
+    return False
+
+def parse_row(row):
+    """Returns entry of 'transactions' table made from a line of statement
+    file or raises ValueError.
+
+    Parameters:
+        row (list): date, value, currency, description and category
+    Returns:
+        tuple: (date, value, currency, desc, categ)
+    """
+    if len(row) < 4:
+        raise ValueError(f"expected at least 4 columns, found {len(row)}")
+    date = parse_date(row[0])
+    value = float(row[1].strip().replace(",", ""))
+    currency = CURRENCY_CODES.get(row[2].strip().upper(), row[2].strip())
+    if currency not in backend.CURRENCY_RATES:
+        raise ValueError(f"unknown currency '{row[2]}'")
+    desc = row[3].strip()
+    if not desc:
+        raise ValueError("empty description")
+    categ = row[4].strip() if len(row) > 4 and row[4].strip() else "Other"
+    return (date, value, currency, desc, categ)
+
+def parse_statement(path):
+    """Reads and validates a statement file. Runs in worker processes.
+
+    Parameters:
+        path (string): Path to CSV statement file
+    Returns:
+        list of tuples: Entries of the file, see parse_row
+    """
+    entries = []
+    with open(path, newline="", encoding="utf-8-sig") as statement:
+        for line, row in enumerate(csv.reader(statement), 1):
+            if not any(cell.strip() for cell in row):
+                continue
+            if line == 1 and is_header(row):
+                continue
+            try:
+                entries.append(parse_row(row))
+            except ValueError as e:
+                raise ValueError(f"line {line}: {e}") from None
+    return entries
+
+def statement_paths(paths):
+    """Returns statement files given, with directories replaced by the CSV
+    files they contain.
+
+    Parameters:
+        paths (list): Paths to statement files or directories
+    Returns:
+        list: Paths to statement files, sorted within each directory
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(".csv"))
+        else:
+            files.append(path)
+    return files
+
+def import_statements(conn, paths, account_id=backend.DEFAULT_ACCOUNT_ID,
+                      skip_duplicates=True, workers=None, progress=None):
+    """Imports statement files into 'transactions' table. Files are parsed
+    in parallel and written in order of completion. Each file is written
+    within a savepoint, so a file that fails is left out entirely.
+
+    Parameters:
+        conn (Connection): Connection object
+        paths (list): Paths to statement files
+        account_id (int): Id of account the entries belong to
+        skip_duplicates (bool): If True, entries already found in the table
+            or in files imported before are not inserted
+        workers (int): Number of processes parsing files, number of CPUs if None
+        progress (function): Called after each file with its result, see Returns
+    Returns:
+        list of tuples: (path, entries imported, duplicates skipped,
+            seconds spent writing, error message or None) for each file
+    """
+    results = []
+    uncommitted = 0
+    cur = conn.cursor()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(parse_statement, path): path for path in paths}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            file_started = time.perf_counter()
+            try:
+                entries = future.result()
+                if not conn.in_transaction:
+                    # releasing the savepoint would otherwise commit each file
+                    cur.execute("BEGIN")
+                cur.execute("SAVEPOINT import_statement")
+                try:
+                    skipped = backend.create_transactions(conn, entries, skip_duplicates,
+                                                          account_id)
+                except sqlite3.Error:
+                    cur.execute("ROLLBACK TO import_statement")
+                    raise
+                finally:
+                    cur.execute("RELEASE import_statement")
+            except (OSError, ValueError, csv.Error, sqlite3.Error) as e:
+                result = (path, 0, 0, time.perf_counter() - file_started, str(e))
+            else:
+                uncommitted += len(entries)
+                result = (path, len(entries) - len(skipped), len(skipped),
+                          time.perf_counter() - file_started, None)
+            if uncommitted >= COMMIT_ROWS:
+                conn.commit()
+                uncommitted = 0
+            results.append(result)
+            if progress is not None:
+                progress(len(results), len(paths), result)
+        conn.commit()
+    return results
+
+def format_progress(done, total, result):
+    """Returns line describing result of import_statements for a file
+
+    Parameters:
+        done (int): Number of files finished
+        total (int): Number of files given
+        result (tuple): Result of the file, see import_statements
+    """
+    path, imported, skipped, seconds, error = result
+    rate = (imported + skipped)/seconds if seconds > 0 else 0
+    if error is not None:
+        return f"[{done}/{total}] {path}: FAILED - {error}"
+    return (f"[{done}/{total}] {path}: {imported} imported, {skipped} duplicates "
+            f"({rate:.0f} entries/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Import statement files in parallel")
+    parser.add_argument("paths", nargs="+", help="CSV statement files or directories")
+    parser.add_argument("--database", default="transaction_database.db",
+                        help="path to database file")
+    parser.add_argument("--account", help="name of account the entries belong to")
+    parser.add_argument("--workers", type=int, help="number of parsing processes")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="insert entries already found in the database")
+    args = parser.parse_args()
+
+    conn = backend.create_connection(args.database)
+    if conn is None:
+        sys.exit(1)
+    backend.create_transactions_table(conn)
+    account_id = backend.DEFAULT_ACCOUNT_ID
+    if args.account is not None:
+        accounts = {name: id for id, name in backend.select_accounts(conn)}
+        if args.account not in accounts:
+            print(f"Unknown account '{args.account}'", file=sys.stderr)
+            sys.exit(1)
+        account_id = accounts[args.account]
+
+    started = time.perf_counter()
+    results = import_statements(conn, statement_paths(args.paths), account_id,
+                                not args.keep_duplicates, args.workers,
+                                lambda *progress: print(format_progress(*progress)))
+    seconds = time.perf_counter() - started
+    imported = sum(result[1] for result in results)
+    skipped = sum(result[2] for result in results)
+    failed = sum(result[4] is not None for result in results)
+    print(f"Imported {imported} entries from {len(results) - failed} files, "
+          f"skipped {skipped} duplicates and {failed} failed files "
+          f"in {seconds:.2f} s ({(imported + skipped)/seconds:.0f} entries/s)")
+    conn.close()
+    if any(result[4] is not None for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+This module keeps a columnar snapshot of 'transactions' table in
+memory-mapped numpy arrays, so that balances and totals by category can be
+computed with vectorized operations instead of SQL queries. Snapshot is
+stored in a directory next to the database file and is refreshed
+incrementally from entries with new id's, using change counters kept by
+triggers to tell when entries were changed, deleted or archived instead.
+
+Balances of date intervals without other conditions are read from prefix
+sums, so they take the same time however many entries the snapshot has.
+Other queries scan the entries of the interval with vectorized masks, so
+their time grows with the number of entries in it. The program itself
+does not read the snapshot yet, it is refreshed and queried from the
+command line and by the benchmark.
+
+Module contains 1 class - ColumnarSnapshot, and a benchmark comparing the
+snapshot with the SQL queries of 'backend' module. To run the benchmark:
+python columnar.py --benchmark 1000000
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+import backend
+
+# column name, numpy type and file name of each snapshot column
+COLUMNS = (("dates", np.int32, "date.i4"),
+           ("values", np.float64, "value.f8"),
+           ("amounts", np.float64, "amount.f8"),
+           ("currencies", np.int8, "currency.i1"),
+           ("categories", np.int16, "categ.i2"),
+           ("accounts", np.int32, "account.i4"),
+           ("cumulative_amounts", np.float64, "cumulative.f8"),
+           ("cumulative_received", np.float64, "cumulative_received.f8"))
+
+# changed whenever snapshot files change, older snapshots are rebuilt
+SNAPSHOT_VERSION = 4
+
+def encode_date(date):
+    """Returns date as an integer YYYYMMDD, e.g. 20200702
+
+    Parameters:
+        date (string): Date in YYYY-MM-DD or YYYY/MM/DD format
+    """
+    date = str(date)
+    return int(date[:4] + date[5:7] + date[8:10])
+
+
+class ColumnarSnapshot:
+    """Class that handles the columnar snapshot of 'transactions' table.
+    Entries are stored sorted by date, so that any date interval is a
+    contiguous slice of the arrays.
+
+    Attributes:
+        directory (string): path to the directory holding snapshot files
+        meta (dict): names of categories and currencies coded in the
+            arrays, last id, number and sums of entries included and
+            change counter of the database, see backend.count_transaction_changes
+        dates (numpy.ndarray): dates as YYYYMMDD integers
+        values (numpy.ndarray): values in the original currency
+        amounts (numpy.ndarray): values converted to GBP(£)
+        currencies (numpy.ndarray): currency codes, see meta["currencies"]
+        categories (numpy.ndarray): category codes, see meta["categories"]
+        accounts (numpy.ndarray): account id's
+        cumulative_amounts (numpy.ndarray): sum of amounts up to and
+            including each entry
+        cumulative_received (numpy.ndarray): sum of positive amounts up to
+            and including each entry
+    """
+
+    def __init__(self, directory):
+        """
+        Parameters:
+            directory (string): path to the directory holding snapshot files
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(os.path.join(directory, "meta.json")) as meta_file:
+                self.meta = json.load(meta_file)
+        except (OSError, ValueError):
+            self.meta = None
+        if self.meta and self.meta.get("version") != SNAPSHOT_VERSION:
+            self.meta = None
+        self.load()
+
+    @classmethod
+    def for_database(cls, conn):
+        """Returns snapshot stored next to the main database file of conn"""
+        return cls(backend.database_path(conn) + ".snapshot")
+
+    def load(self):
+        """Memory-maps snapshot files."""
+        entries = self.meta["entries"] if self.meta else 0
+        for name, dtype, file_name in COLUMNS:
+            if entries:
+                column = np.memmap(os.path.join(self.directory, file_name),
+                                   dtype=dtype, mode="r", shape=(entries,))
+            else:
+                column = np.empty(0, dtype=dtype)
+            setattr(self, name, column)
+
+    def refresh(self, conn):
+        """Brings snapshot up to date with the database. New entries are
+        appended if they are not older than the latest entry in the snapshot,
+        otherwise the snapshot is rebuilt, as it is when entries were changed,
+        deleted, restored or archived. Checking for changes reads one entry
+        of the main database, however many entries there are.
+
+        Parameters:
+            conn (Connection): Connection object
+        Returns:
+            int: Number of entries added to the snapshot
+        """
+        if self.meta is None:
+            return self.rebuild(conn)
+        changes = backend.count_transaction_changes(conn)
+        if changes != self.meta["changes"]:
+            return self.rebuild(conn)
+        cur = conn.cursor()
+        # unary + keeps the planner on the id range instead of reading the
+        # whole table in order of the date index
+        cur.execute('''SELECT id, date, value, currency, categ, account_id
+                        FROM main.transactions
+                        WHERE id > ? AND deleted_at IS NULL
+                        ORDER BY +date, id ''', (self.meta["last_id"],))
+        rows = cur.fetchall()
+        if not rows:
+            return 0
+        if encode_date(rows[0][1]) < self.meta["max_date"]:
+            return self.rebuild(conn)
+        self._write(rows, "ab")
+        self._save_meta()
+        return len(rows)
+
+    def rebuild(self, conn):
+        """Writes snapshot of the main and archive databases from scratch.
+
+        Parameters:
+            conn (Connection): Connection object
+        Returns:
+            int: Number of entries in the snapshot
+        """
+        self.meta = {"version": SNAPSHOT_VERSION,
+                     "currencies": [], "categories": [], "last_id": 0,
+                     "max_date": 0, "entries": 0, "total": 0.0, "received": 0.0,
+                     "changes": backend.count_transaction_changes(conn)}
+        for name, dtype, file_name in COLUMNS:
+            setattr(self, name, np.empty(0, dtype=dtype))
+            open(os.path.join(self.directory, file_name), "wb").close()
+        rows = backend.iterate_transactions(
+            conn, "id, date, value, currency, categ, account_id",
+            "0000-00-00", "9999-99-99")
+        while True:
+            chunk = list(itertools.islice(rows, 100000))
+            if not chunk:
+                break
+            self._write(chunk, "ab")
+        self._save_meta()
+        return self.meta["entries"]
+
+    def _write(self, rows, mode):
+        """Appends rows of (id, date, value, currency, categ, account_id)
+        to snapshot files"""
+        # release memory maps before files are resized
+        for name, dtype, _ in COLUMNS:
+            setattr(self, name, np.empty(0, dtype=dtype))
+        currencies = self.meta["currencies"]
+        categories = self.meta["categories"]
+        for row in rows:
+            if row[3] not in currencies:
+                currencies.append(row[3])
+            if row[4] not in categories:
+                categories.append(row[4])
+        currency_codes = {currency: code for code, currency in enumerate(currencies)}
+        category_codes = {categ: code for code, categ in enumerate(categories)}
+        rates = np.array([backend.CURRENCY_RATES.get(currency, 1)
+                          for currency in currencies])
+        columns = {
+            "dates": np.array([encode_date(row[1]) for row in rows], dtype=np.int32),
+            "values": np.array([row[2] for row in rows], dtype=np.float64),
+            "currencies": np.array([currency_codes[row[3]] for row in rows],
+                                   dtype=np.int8),
+            "categories": np.array([category_codes[row[4]] for row in rows],
+                                   dtype=np.int16),
+            "accounts": np.array([row[5] or 0 for row in rows], dtype=np.int32)}
+        columns["amounts"] = columns["values"]*rates[columns["currencies"]]
+        columns["cumulative_amounts"] = self.meta["total"] + np.cumsum(columns["amounts"])
+        columns["cumulative_received"] = (self.meta["received"]
+                                          + np.cumsum(np.maximum(columns["amounts"], 0)))
+        for name, dtype, file_name in COLUMNS:
+            with open(os.path.join(self.directory, file_name), mode) as column_file:
+                column_file.write(columns[name].astype(dtype).tobytes())
+        self.meta["last_id"] = max(self.meta["last_id"], max(row[0] for row in rows))
+        self.meta["max_date"] = max(self.meta["max_date"], int(columns["dates"].max()))
+        self.meta["entries"] += len(rows)
+        self.meta["total"] = float(columns["cumulative_amounts"][-1])
+        self.meta["received"] = float(columns["cumulative_received"][-1])
+
+    def _save_meta(self):
+        """Saves snapshot description and maps the updated files"""
+        with open(os.path.join(self.directory, "meta.json"), "w") as meta_file:
+            json.dump(self.meta, meta_file)
+        self.load()
+
+    def _select(self, date_from, date_to, *args, accounts=None):
+        """Returns slice of the arrays in the date interval and mask of
+        entries matching the other conditions, or None if all entries match.
+
+        Parameters:
+            date_from (string): Earliest date to select entries from
+            data_to (string): Latest date to select entries from
+            *args: Variable length argument list, same as in
+                backend.select_transactions, but without search in description
+            accounts (list): Id's of accounts to select entries from, all if None
+        """
+        if len(args) in (2, 4):
+            raise ValueError("Search in description is not supported by snapshot")
+        start = np.searchsorted(self.dates, np.int32(encode_date(date_from)), side="left")
+        end = np.searchsorted(self.dates, np.int32(encode_date(date_to)), side="right")
+        selected = slice(start, end)
+        mask = None
+        if len(args) == 3:
+            values = self.values[selected]
+            mask = (values >= args[0]) & (values <= args[1])
+            args = args[2:]
+        if args and args[0] != "All":
+            if args[0] in self.meta["categories"]:
+                code = self.meta["categories"].index(args[0])
+                category_mask = self.categories[selected] == code
+            else:
+                category_mask = np.zeros(end - start, dtype=bool)
+            mask = category_mask if mask is None else mask & category_mask
+        if accounts is not None:
+            account_mask = np.isin(self.accounts[selected], list(accounts))
+            mask = account_mask if mask is None else mask & account_mask
+        return selected, mask
+
+    @staticmethod
+    def _sum_of_slice(cumulative, selected):
+        """Returns sum of entries in a slice of the arrays read from prefix sums"""
+        if selected.stop <= selected.start:
+            return 0.0
+        before = cumulative[selected.start - 1] if selected.start else 0.0
+        return float(cumulative[selected.stop - 1] - before)
+
+    def get_balance(self, date_from, date_to, *args, accounts=None):
+        """Returns dictionary containing amount spent, received and total balance.
+        Same as backend.get_balance.
+        """
+        selected, mask = self._select(date_from, date_to, *args, accounts=accounts)
+        if mask is None:
+            received = self._sum_of_slice(self.cumulative_received, selected)
+            total = self._sum_of_slice(self.cumulative_amounts, selected)
+            return {"Expenses":total - received, "Received":received, "Total":total}
+        amounts = self.amounts[selected][mask]
+        received = float(np.maximum(amounts, 0).sum())
+        total = float(amounts.sum())
+        return {"Expenses":total - received, "Received":received, "Total":total}
+
+    def get_expenses_by_category(self, date_from, date_to, *args, accounts=None):
+        """Returns total expenses for each category found.
+        Same as backend.get_expenses_by_category.
+        """
+        selected, mask = self._select(date_from, date_to, *args, accounts=accounts)
+        codes = self.categories[selected]
+        amounts = self.amounts[selected]
+        if mask is not None:
+            codes = codes[mask]
+            amounts = amounts[mask]
+        names = self.meta["categories"] if self.meta else []
+        totals = np.bincount(codes, weights=amounts, minlength=len(names))
+        found = np.bincount(codes, minlength=len(names))
+        return {f"{names[code]}": float(totals[code]) for code in np.flatnonzero(found)}
+
+    def get_monthly_totals(self, date_from, date_to, accounts=None):
+        """Returns total balance of each month in the date interval.
+
+        Parameters:
+            date_from (string): Earliest date to select entries from
+            data_to (string): Latest date to select entries from
+            accounts (list): Id's of accounts to select entries from, all if None
+        Returns:
+            dict: Total balance in GBP(£) for each month, e.g. "2020-07"
+        """
+        selected, mask = self._select(date_from, date_to, accounts=accounts)
+        months = self.dates[selected]//100
+        amounts = self.amounts[selected]
+        if mask is not None:
+            months = months[mask]
+            amounts = amounts[mask]
+        if not len(months):
+            return {}
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(months)) + 1))
+        totals = np.add.reduceat(amounts, starts)
+        return {f"{months[start]//100}-{months[start]%100:02d}": float(total)
+                for start, total in zip(starts, totals)}
+
+
+def benchmark(entries, repeat=5):
+    """Compares SQL queries of 'backend' module with the snapshot on a
+    temporary database filled with random entries.
+
+    Parameters:
+        entries (int): Number of entries in the database
+        repeat (int): Number of times each query is timed
+    """
+    categories = ['Groceries', 'Shopping', 'Entertainment', 'Restaurants/Bars',
+                  'Subscriptions', 'Rent', 'Sports', 'Transport',
+                  'Debt', 'Salary', 'Cash withdrawal', 'Other']
+    with tempfile.TemporaryDirectory() as directory:
+        conn = backend.create_connection(os.path.join(directory, "benchmark.db"))
+        with conn:
+            backend.create_transactions_table(conn)
+            conn.executemany(
+                "INSERT INTO transactions(date, value, currency, desc, categ) "
+                "VALUES(?, ?, ?, ?, ?)",
+                ((f"{random.randint(2010, 2020)}-{random.randint(1, 12):02d}-"
+                  f"{random.randint(1, 28):02d}",
+                  round(random.uniform(-100, 100), 2),
+                  random.choice(["£", "€", "$"]),
+                  "benchmark",
+                  random.choice(categories)) for _ in range(entries)))
+
+        start = time.perf_counter()
+        snapshot = ColumnarSnapshot.for_database(conn)
+        snapshot.refresh(conn)
+        print(f"Snapshot of {entries} entries built in "
+              f"{time.perf_counter() - start:.2f}s")
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            snapshot.refresh(conn)
+            timings.append(time.perf_counter() - start)
+        print(f"Refresh without new entries: {min(timings)*1000:.2f}ms")
+
+        queries = (("get_balance", ()),
+                   ("get_balance", ("Groceries",)),
+                   ("get_expenses_by_category", ()),
+                   ("get_expenses_by_category", (-50, 50, "All")))
+        for name, args in queries:
+            for label, function in (("SQL", lambda: getattr(backend, name)(
+                                        conn, "2012-01-01", "2018-12-31", *args)),
+                                    ("snapshot", lambda: getattr(snapshot, name)(
+                                        "2012-01-01", "2018-12-31", *args))):
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    function()
+                    timings.append(time.perf_counter() - start)
+                print(f"{name}{args} {label}: {min(timings)*1000:.1f}ms")
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar snapshot of transactions")
+    parser.add_argument("--database", default="transaction_database.db",
+                        help="path to database file")
+    parser.add_argument("--benchmark", type=int, metavar="ENTRIES",
+                        help="compare snapshot and SQL queries on random entries")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+    conn = backend.create_connection(args.database)
+    if conn is None:
+        sys.exit(1)
+    backend.create_transactions_table(conn)
+    snapshot = ColumnarSnapshot.for_database(conn)
+    print(f"Added {snapshot.refresh(conn)} entries to snapshot")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
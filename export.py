@@ -0,0 +1,254 @@
+"""
+This module exports the database of Budget Tracker program. Consistent
+snapshots of the database file are taken with SQLite online backup API a
+few pages at a time, so that the program can keep writing to the database
+while a snapshot is taken. Entries of 'transactions' table matching
+conditions given are streamed to gzip-compressed CSV or JSON Lines files in
+chunks, without holding all of them in memory.
+
+Module contains functions backup_database(source, target, pages, progress),
+export_transactions(conn, path, date_from, date_to, *args, accounts, progress)
+and export_format(path), and 1 exception - BackupRestartedError(Exception).
+To export from the command line:
+python export.py backup backups/transaction_database.db
+python export.py transactions transactions.csv.gz --from 2020-01-01 --to 2020-12-31
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+import backend
+
+# pages copied by each step of a backup, other connections can write between steps
+BACKUP_PAGES = 256
+
+# times a backup can be restarted by other connections writing to the database
+# before the rest of it is copied in one step, holding writers off meanwhile
+BACKUP_MAX_RESTARTS = 3
+
+# entries fetched from the database and written at once
+EXPORT_CHUNK_SIZE = 5000
+
+# columns written to export files
+EXPORT_COLUMNS = ("date", "value", "currency", "desc", "categ", "account")
+
+class BackupRestartedError(Exception):
+    """Exception thrown to stop a backup restarted too many times"""
+    pass
+
+
+def backup_database(source, target, pages=BACKUP_PAGES, progress=None):
+    """Copies database file and its archive databases to target path using
+    SQLite online backup API. Archive databases are copied next to target
+    and renamed after it, e.g. backup_2015.db for backup.db. Can be run in
+    a thread other than the one using the database.
+
+    Parameters:
+        source (string): Path to database file
+        target (string): Path to file to write snapshot to
+        pages (int): Number of pages copied by each step
+        progress (function): Called after each step with pages copied and
+            total pages of the file being copied
+    Returns:
+        tuple: (int): bytes copied, (float): seconds spent
+    """
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    copied = backup_file(source, target, pages, progress)
+    target_conn = backend.create_connection(target)
+    try:
+        partitions = target_conn.execute(
+            "SELECT year, path FROM archive_partitions").fetchall()
+    except sqlite3.OperationalError:
+        # database made by an older version, see create_transactions_table
+        partitions = []
+    stem = os.path.splitext(os.path.basename(target))[0]
+    for year, path in partitions:
+        archive_path = os.path.join(os.path.dirname(source), path)
+        if not os.path.exists(archive_path):
+            print(f"Archive database {archive_path} not found", file=sys.stderr)
+            continue
+        copy_name = f"{stem}_{year}.db"
+        copied += backup_file(archive_path,
+                              os.path.join(os.path.dirname(target), copy_name),
+                              pages, progress)
+        with target_conn:
+            target_conn.execute("UPDATE archive_partitions SET path = ? WHERE year = ?",
+                                (copy_name, year))
+    target_conn.close()
+    return copied, time.perf_counter() - started
+
+def backup_file(source, target, pages=BACKUP_PAGES, progress=None):
+    """Copies one database file to target path using SQLite online backup API.
+
+    Parameters:
+        source (string): Path to database file
+        target (string): Path to file to write snapshot to
+        pages (int): Number of pages copied by each step
+        progress (function): Called after each step with pages copied and
+            total pages of the file
+    Returns:
+        int: bytes copied
+    """
+    restarts = 0
+    last_copied = 0
+
+    def on_step(status, remaining, total):
+        nonlocal restarts, last_copied
+        if total - remaining < last_copied:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise BackupRestartedError()
+        last_copied = total - remaining
+        if progress is not None:
+            progress(total - remaining, total)
+
+    source_conn = sqlite3.connect(source)
+    target_conn = sqlite3.connect(target)
+    try:
+        try:
+            source_conn.backup(target_conn, pages=pages, progress=on_step)
+        except BackupRestartedError:
+            last_copied = 0
+            source_conn.backup(target_conn, pages=-1, progress=on_step)
+        page_size = target_conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = target_conn.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target_conn.close()
+        source_conn.close()
+    return page_size*page_count
+
+def export_format(path):
+    """Returns format of export file from its name, 'csv' or 'jsonl'.
+
+    Parameters:
+        path (string): Path to file ending with .csv.gz or .jsonl.gz
+    """
+    name = path.lower()
+    for file_format in ("csv", "jsonl"):
+        if name.endswith(f".{file_format}.gz"):
+            return file_format
+    raise ValueError(f"Cannot export to '{path}', use .csv.gz or .jsonl.gz")
+
+def export_transactions(conn, path, date_from, date_to, *args, accounts=None,
+                        chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """Writes entries of 'transactions' table matching conditions given to
+    gzip-compressed CSV or JSON Lines file, chunk by chunk in order of date.
+    Entries are read in one query, so the file matches the database at one
+    point in time, unless they span more archived years than a connection
+    can attach at once, see backend.archive_groups.
+
+    Parameters:
+        conn (Connection): Connection object
+        path (string): Path to file ending with .csv.gz or .jsonl.gz
+        date_from (string): Earliest date to select entries from
+        data_to (string): Latest date to select entries from
+        *args: Variable length argument list, same as in
+            backend.select_transactions
+        accounts (list): Id's of accounts to select entries from, all if None
+        chunk_size (int): Number of entries fetched and written at once
+        progress (function): Called after each chunk with entries written
+    Returns:
+        tuple: (int): entries written, (float): seconds spent
+    """
+    file_format = export_format(path)
+    started = time.perf_counter()
+    account_names = dict(backend.select_accounts(conn))
+    entries = backend.iterate_transactions(conn, backend.TRANSACTION_COLUMNS,
+                                           date_from, date_to, *args, accounts=accounts,
+                                           forecast=True)
+    written = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as export_file:
+        if file_format == "csv":
+            writer = csv.writer(export_file)
+            writer.writerow(EXPORT_COLUMNS)
+        while True:
+            chunk = list(itertools.islice(entries, chunk_size))
+            if not chunk:
+                break
+            rows = [(date, value, currency, desc, categ, account_names.get(account_id))
+                    for _, date, value, currency, desc, categ, account_id in chunk]
+            if file_format == "csv":
+                writer.writerows(rows)
+            else:
+                export_file.writelines(
+                    json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n"
+                    for row in rows)
+            written += len(rows)
+            if progress is not None:
+                progress(written)
+    return written, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Budget Tracker export tools")
+    parser.add_argument("--database", default="transaction_database.db",
+                        help="path to database file")
+    subparsers = parser.add_subparsers(dest="command")
+    backup_parser = subparsers.add_parser(
+        "backup", help="take a consistent snapshot of the database")
+    backup_parser.add_argument("target", help="path to snapshot file")
+    backup_parser.add_argument("--pages", type=int, default=BACKUP_PAGES,
+                               help="pages copied by each step")
+    export_parser = subparsers.add_parser(
+        "transactions", help="export transactions to .csv.gz or .jsonl.gz file")
+    export_parser.add_argument("path", help="path to export file")
+    export_parser.add_argument("--from", dest="date_from", default="0000-01-01",
+                               help="earliest date to export, YYYY-MM-DD")
+    # future occurrences of recurring transactions are exported up to this
+    # date, see backend.forecast_recurring_transactions
+    export_parser.add_argument("--to", dest="date_to",
+                               default=datetime.date.today().isoformat(),
+                               help="latest date to export, YYYY-MM-DD, today by default")
+    export_parser.add_argument("--category", default="All",
+                               help="category to export")
+    export_parser.add_argument("--search", help="text to search in descriptions")
+    export_parser.add_argument("--account", help="name of account to export")
+    args = parser.parse_args()
+
+    if args.command == "backup":
+        try:
+            copied, seconds = backup_database(
+                args.database, args.target, args.pages,
+                lambda done, total: print(f"\rCopied {done}/{total} pages", end=""))
+        except (OSError, sqlite3.Error) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        print(f"\nCopied {copied/2**20:.1f} MiB in {seconds:.2f} s "
+              f"({copied/2**20/max(seconds, 1e-9):.1f} MiB/s)")
+    elif args.command == "transactions":
+        conn = backend.create_connection(args.database)
+        if conn is None:
+            sys.exit(1)
+        accounts = None
+        if args.account is not None:
+            names = {name: id for id, name in backend.select_accounts(conn)}
+            if args.account not in names:
+                print(f"Unknown account '{args.account}'", file=sys.stderr)
+                sys.exit(1)
+            accounts = [names[args.account]]
+        filters = (args.category,) if args.search is None else (args.category, args.search)
+        try:
+            with conn:
+                written, seconds = export_transactions(
+                    conn, args.path, args.date_from, args.date_to, *filters,
+                    accounts=accounts,
+                    progress=lambda written: print(f"\rExported {written} entries", end=""))
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        finally:
+            conn.close()
+        print(f"\nExported {written} entries in {seconds:.2f} s "
+              f"({written/max(seconds, 1e-9):.0f} entries/s)")
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
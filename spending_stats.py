@@ -0,0 +1,218 @@
+"""
+This module computes spending statistics of 'transactions' table in one
+streaming pass over a database cursor: transaction size percentiles and
+totals for each category and month, trends of monthly totals and a 30-day
+rolling average of daily expenses. Percentiles are estimated with mergeable
+sketches, so that statistics of any range of months are combined from
+monthly results without reading the entries again.
+
+Module contains 3 classes - QuantileSketch, MonthlyStatistics and
+SpendingStatistics, and function stream_statistics(conn, date_from, date_to, *args).
+"""
+
+import collections
+import datetime
+import math
+import backend
+
+# window of the rolling average of daily expenses, in days
+ROLLING_WINDOW = 30
+
+class QuantileSketch:
+    """Class that estimates quantiles of positive values within a relative
+    error. Values are counted in logarithmic buckets, so sketches of
+    different months can be merged into a sketch of all of them.
+
+    Attributes:
+        relative_accuracy (float): maximum relative error of quantiles
+        gamma (float): ratio between bounds of a bucket
+        buckets (dict): number of values in each bucket by bucket key
+        zero_count (int): number of values too small to be bucketed
+        count (int): number of values added
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        """
+        Parameters:
+            relative_accuracy (float): maximum relative error of quantiles
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy)/(1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = collections.Counter()
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        """Adds a value to the sketch
+
+        Parameters:
+            value (float): value to be added, negative values are added
+                as their absolute value
+        """
+        value = abs(value)
+        if value < 1e-9:
+            self.zero_count += 1
+        else:
+            self.buckets[math.ceil(math.log(value)/self.log_gamma)] += 1
+        self.count += 1
+
+    def merge(self, other):
+        """Adds values of another sketch with the same accuracy to this one.
+
+        Parameters:
+            other (QuantileSketch): sketch to be merged
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches of different accuracy")
+        self.buckets.update(other.buckets)
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        """Returns estimate of the value at given quantile.
+
+        Parameters:
+            q (float): quantile between 0 and 1, e.g. 0.5 for the median
+        Returns:
+            float: estimated value or None if sketch is empty
+        """
+        if not self.count:
+            return None
+        rank = q*(self.count - 1)
+        cumulative = self.zero_count
+        if rank < cumulative:
+            return 0.0
+        for key in sorted(self.buckets):
+            cumulative += self.buckets[key]
+            if cumulative > rank:
+                return 2*self.gamma**key/(self.gamma + 1)
+        return 2*self.gamma**max(self.buckets)/(self.gamma + 1)
+
+
+class MonthlyStatistics:
+    """Class that holds statistics of one category in one month.
+
+    Attributes:
+        total (float): balance of the entries in GBP(£)
+        sketch (QuantileSketch): sizes of the entries in GBP(£)
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.sketch = QuantileSketch()
+
+    def add(self, amount):
+        """Adds an entry of given amount in GBP(£)"""
+        self.total += amount
+        self.sketch.add(amount)
+
+
+class SpendingStatistics:
+    """Class that holds statistics computed by stream_statistics.
+
+    Attributes:
+        monthly (dict): MonthlyStatistics by (category, "YYYY-MM")
+        rolling_average (list): (date, average daily expenses in GBP(£) over
+            the last ROLLING_WINDOW days) for each date with entries
+    """
+
+    def __init__(self):
+        self.monthly = {}
+        self.rolling_average = []
+
+    def months(self):
+        """Returns sorted list of months having entries"""
+        return sorted({month for _, month in self.monthly})
+
+    def category_summary(self, months=None):
+        """Returns statistics of each category over the months given,
+        merged from monthly statistics.
+
+        Parameters:
+            months (list): months as "YYYY-MM" strings, all months if None
+        Returns:
+            dict: 'Entries', 'Total', 'Median' and 'P90' entry size in GBP(£)
+                and 'Trend' of monthly totals in GBP(£) per month, by category
+        """
+        months = set(self.months() if months is None else months)
+        merged = {}
+        totals = collections.defaultdict(dict)
+        for (categ, month), statistics in sorted(self.monthly.items()):
+            if month not in months:
+                continue
+            if categ not in merged:
+                merged[categ] = QuantileSketch(statistics.sketch.relative_accuracy)
+            merged[categ].merge(statistics.sketch)
+            totals[categ][month] = statistics.total
+        return {categ: {"Entries": sketch.count,
+                        "Total": sum(totals[categ].values()),
+                        "Median": sketch.quantile(0.5),
+                        "P90": sketch.quantile(0.9),
+                        "Trend": trend(totals[categ])}
+                for categ, sketch in merged.items()}
+
+
+def month_number(month):
+    """Returns number of months since year 0 of a "YYYY-MM" string"""
+    return int(month[:4])*12 + int(month[5:7]) - 1
+
+def trend(monthly_totals):
+    """Returns slope of least squares line through monthly totals.
+
+    Parameters:
+        monthly_totals (dict): totals by "YYYY-MM" month
+    Returns:
+        float: change of total per month or None if less than 2 months given
+    """
+    if len(monthly_totals) < 2:
+        return None
+    points = [(month_number(month), total) for month, total in monthly_totals.items()]
+    mean_x = sum(x for x, _ in points)/len(points)
+    mean_y = sum(y for _, y in points)/len(points)
+    variance = sum((x - mean_x)**2 for x, _ in points)
+    return sum((x - mean_x)*(y - mean_y) for x, y in points)/variance
+
+def stream_statistics(conn, date_from, date_to, *args, accounts=None):
+    """Computes spending statistics of entries matching conditions given,
+    reading them from the database one by one in order of date.
+
+    Parameters:
+        conn (Connection): Connection object
+        date_from (string): Earliest date to select entries from
+        data_to (string): Latest date to select entries from
+        *args: Variable length argument list, same as in
+            backend.select_transactions
+        accounts (list): Id's of accounts to select entries from, all if None
+    Returns:
+        SpendingStatistics: statistics of the entries
+    """
+    statistics = SpendingStatistics()
+    entries = backend.iterate_transactions(conn, "id, date, value, currency, categ",
+                                           date_from, date_to, *args, accounts=accounts,
+                                           forecast=True)
+
+    window = collections.deque()
+    window_expenses = 0
+    current_date = None
+    for _, date, value, currency, categ in entries:
+        amount = value*backend.CURRENCY_RATES.get(currency, 1)
+        key = (f"{categ}", date[:7])
+        if key not in statistics.monthly:
+            statistics.monthly[key] = MonthlyStatistics()
+        statistics.monthly[key].add(amount)
+
+        if date != current_date:
+            if current_date is not None:
+                statistics.rolling_average.append(
+                    (current_date, window_expenses/ROLLING_WINDOW))
+            current_date = date
+            day = datetime.date.fromisoformat(date[:10])
+            while window and (day - window[0][0]).days >= ROLLING_WINDOW:
+                window_expenses -= window.popleft()[1]
+        if amount < 0:
+            window.append((day, -amount))
+            window_expenses += -amount
+    if current_date is not None:
+        statistics.rolling_average.append((current_date, window_expenses/ROLLING_WINDOW))
+    return statistics